@@ -0,0 +1,191 @@
+import re
+
+from .expressions import NUMBER_PATTERN, sort_key
+from .overflow import materialize
+
+INTEGER_PATTERN = re.compile(r"[+-]?\d+")
+
+# -- Aggregate functions.
+#    Each aggregate is a class with a step method, called with the value of
+#    its column for every row of a group, and a result method.
+#    Refer to https://www.sqlite.org/lang_aggfunc.html
+
+
+class Count:
+    """COUNT(col) counts the non-NULL values, COUNT(*) counts every row."""
+
+    def __init__(self, star=False):
+        self.star = star
+        self.n = 0
+
+    def step(self, value):
+        if self.star or value is not None:
+            self.n += 1
+
+    def result(self):
+        return self.n
+
+
+def numeric_value(value):
+    """Return a non-NULL value as the number that SUM and AVG add up. Text
+    that looks like an integer or a real is converted to one. Other text
+    and BLOBs count as their leading number, or 0, and as a real, so that
+    a sum including them is a real too, as in SQLite."""
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    else:
+        text = value.strip()
+        if INTEGER_PATTERN.fullmatch(text):
+            n = int(text)
+            if -(2**63) <= n < 2**63:
+                return n
+        if NUMBER_PATTERN.fullmatch(text):
+            return float(text)
+    prefix = NUMBER_PATTERN.match(value.lstrip())
+    return float(prefix.group()) if prefix else 0.0
+
+
+class Sum:
+    """SUM(col) is an integer if every non-NULL value is, and NULL if there
+    are no non-NULL values. Values that aren't numbers are converted as by
+    numeric_value. Like SQLite, an integer sum that doesn't fit in 64 bits
+    is an error."""
+
+    def __init__(self):
+        self.total = None
+
+    def step(self, value):
+        if value is None:
+            return
+        value = numeric_value(value)
+        self.total = value if self.total is None else self.total + value
+
+    def result(self):
+        if isinstance(self.total, int) and not -(2**63) <= self.total < 2**63:
+            raise OverflowError("integer overflow")
+        return self.total
+
+
+class Avg:
+    """AVG(col) is always a float, or NULL if there are no non-NULL values."""
+
+    def __init__(self):
+        self.total = 0
+        self.n = 0
+
+    def step(self, value):
+        if value is None:
+            return
+        self.total += numeric_value(value)
+        self.n += 1
+
+    def result(self):
+        return self.total / self.n if self.n else None
+
+
+class Min:
+    """MIN(col) is the smallest non-NULL value, in SQLite's sort order."""
+
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None and (
+            self.value is None or sort_key(value) < sort_key(self.value)
+        ):
+            self.value = value
+
+    def result(self):
+        return self.value
+
+
+class Max:
+    """MAX(col) is the largest non-NULL value, in SQLite's sort order."""
+
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None and (
+            self.value is None or sort_key(value) > sort_key(self.value)
+        ):
+            self.value = value
+
+    def result(self):
+        return self.value
+
+
+class Bare:
+    """A plain column in an aggregate query takes its value from the last
+    row of the group. For the GROUP BY columns that is the group's key."""
+
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+AGGREGATES = {"count": Count, "sum": Sum, "avg": Avg, "min": Min, "max": Max}
+
+
+def is_aggregate(function_name):
+    return function_name in AGGREGATES
+
+
+# END
+
+
+# -- Hash aggregation.
+
+
+def make_accumulators(outputs):
+    accumulators = []
+    for function_name, position in outputs:
+        if function_name == "identity":
+            accumulators.append(Bare())
+        elif function_name == "count" and position is None:
+            accumulators.append(Count(star=True))
+        else:
+            accumulators.append(AGGREGATES[function_name]())
+    return accumulators
+
+
+def aggregate(rows, group_by, outputs):
+    """
+    Aggregate a stream of rows with a hash table of groups, yielding one
+    row of results per group. Only the accumulators of each group are
+    kept, so memory grows with the number of groups, not of rows.
+
+    group_by holds the positions in the row of the GROUP BY columns, and
+    outputs is a list of (function name, position in the row), where the
+    function name is "identity" for plain columns and the position is None
+    for COUNT(*). Groups come out ordered by their key, as they do from
+    SQLite. Without GROUP BY there is exactly one group, even for no rows.
+    """
+    groups = {}
+    if not group_by:
+        groups[()] = make_accumulators(outputs)
+    steps = [
+        (accumulator_index, position)
+        for accumulator_index, (_, position) in enumerate(outputs)
+    ]
+    for row in rows:
+        key = tuple(materialize(row[i]) for i in group_by)
+        accumulators = groups.get(key)
+        if accumulators is None:
+            accumulators = groups[key] = make_accumulators(outputs)
+        for accumulator_index, position in steps:
+            accumulators[accumulator_index].step(
+                None if position is None else materialize(row[position])
+            )
+    for key in sorted(groups, key=lambda key: tuple(map(sort_key, key))):
+        yield [accumulator.result() for accumulator in groups[key]]
+
+
+# END
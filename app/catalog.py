@@ -0,0 +1,268 @@
+import json
+import os
+
+from .expressions import tokenize
+
+# Bump this when the layout of the cached catalog changes.
+CATALOG_FORMAT_VERSION = 4
+
+# Words that start a column constraint, and so end the declared type.
+COLUMN_CONSTRAINT_WORDS = {
+    "constraint",
+    "primary",
+    "not",
+    "null",
+    "unique",
+    "check",
+    "default",
+    "collate",
+    "references",
+    "generated",
+    "as",
+}
+
+# Words that start a table constraint rather than a column definition.
+TABLE_CONSTRAINT_WORDS = {"constraint", "primary", "unique", "check", "foreign"}
+
+
+class Catalog:
+    """
+    The tables and indexes of a database, parsed once from sqlite_master.
+
+    Tables are dicts with the keys name, rootpage, columns (names), types
+    (declared types), collations (upper-cased, BINARY unless declared with
+    COLLATE) and rowid_alias (the INTEGER PRIMARY KEY column, or
+    None). Indexes are dicts with the keys name, table, rootpage, columns
+    (names, or None for an expression) and partial (True if the index has
+    a WHERE clause, and so does not hold every row).
+
+    The catalog can be cached in a JSON sidecar file. The identity of the
+    database file (see database_identity) and the schema cookie from its
+    header are stored with it, and a cached catalog is only used if both
+    still match. The cookie alone is a small counter, which different
+    databases often share.
+    """
+
+    def __init__(self, schema_cookie, tables, indexes):
+        self.schema_cookie = schema_cookie
+        self.tables = tables
+        self.indexes = indexes
+
+    @classmethod
+    def from_schema_rows(cls, schema_cookie, rows):
+        """Build the catalog from the rows of sqlite_master, which are
+        (type, name, tbl_name, rootpage, sql)."""
+        tables, indexes = {}, []
+        for type_, name, tbl_name, rootpage, sql in rows:
+            if type_ == "table":
+                table = {"name": name, "rootpage": rootpage}
+                table.update(parse_create_table(sql))
+                tables[name.lower()] = table
+            elif type_ == "index":
+                index = {"name": name, "table": tbl_name, "rootpage": rootpage}
+                # Automatic indexes, for UNIQUE and PRIMARY KEY constraints,
+                # have no SQL. They index the constrained columns, but which
+                # those are is only recorded in the table's SQL.
+                if sql is None:
+                    index.update(columns=[], partial=False)
+                else:
+                    index.update(parse_create_index(sql))
+                indexes.append(index)
+        return cls(schema_cookie, tables, indexes)
+
+    @classmethod
+    def load(cls, path, database, schema_cookie):
+        """Return the catalog cached at path for the database (as from
+        database_identity), or None if there is none or it is stale."""
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("version") != CATALOG_FORMAT_VERSION:
+            return None
+        if cached.get("database") != database:
+            return None
+        if cached.get("schema_cookie") != schema_cookie:
+            return None
+        return cls(schema_cookie, cached["tables"], cached["indexes"])
+
+    def save(self, path, database):
+        """Cache the catalog of the database (as from database_identity) at
+        path. Failing to write the cache (say, in a read-only directory) is
+        not an error, it just won't be reused."""
+        cached = {
+            "version": CATALOG_FORMAT_VERSION,
+            "database": database,
+            "schema_cookie": self.schema_cookie,
+            "tables": self.tables,
+            "indexes": self.indexes,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def table(self, table_name):
+        try:
+            return self.tables[table_name.lower()]
+        except KeyError:
+            raise ValueError(f"No such table: {table_name}") from None
+
+    def table_indexes(self, table_name):
+        table_name = self.table(table_name)["name"].lower()
+        return [i for i in self.indexes if i["table"].lower() == table_name]
+
+
+def database_identity(database_file_path):
+    """Return what identifies a database file, and its contents, in the
+    catalog cache: its real path, the device and inode it is stored on, and
+    its size and modification time. Copying another database over the file
+    keeps the path and inode, but not the modification time, so any write
+    makes the cache stale."""
+    stat = os.stat(database_file_path)
+    return [
+        os.path.realpath(database_file_path),
+        stat.st_dev,
+        stat.st_ino,
+        stat.st_size,
+        stat.st_mtime_ns,
+    ]
+
+
+# -- Parsing CREATE statements.
+#    Refer to https://www.sqlite.org/lang_createtable.html and
+#    https://www.sqlite.org/lang_createindex.html
+
+
+def is_word(token, *words):
+    kind, value = token
+    return kind in ("identifier", "keyword") and value.lower() in words
+
+
+def split_parenthesised(tokens, start):
+    """Split the tokens inside the parentheses opening at tokens[start] on
+    the commas that are not nested in further parentheses.
+    Return the list of groups and the position after the closing parenthesis."""
+    groups, group, depth = [], [], 0
+    for position in range(start + 1, len(tokens)):
+        token = tokens[position]
+        if token == ("operator", "("):
+            depth += 1
+        elif token == ("operator", ")"):
+            if depth == 0:
+                groups.append(group)
+                return groups, position + 1
+            depth -= 1
+        elif token == ("operator", ",") and depth == 0:
+            groups.append(group)
+            group = []
+            continue
+        group.append(token)
+    raise ValueError("Unbalanced parentheses")
+
+
+def render_type(tokens):
+    """Render the tokens of a declared type, e.g. "varchar(20)"."""
+    out = ""
+    for kind, value in tokens:
+        if value in ("(", ")", ","):
+            out += value
+        else:
+            out += ("" if out.endswith(("(", ",")) or not out else " ") + str(value)
+    return out
+
+
+def parse_column_definition(tokens):
+    """Return (name, declared type, collation, whether it is an INTEGER
+    PRIMARY KEY)."""
+    name = tokens[0][1]
+    end = 1
+    while end < len(tokens) and not is_word(tokens[end], *COLUMN_CONSTRAINT_WORDS):
+        end += 1
+    declared_type = render_type(tokens[1:end])
+    constraints = tokens[end:]
+    primary_key = any(
+        is_word(a, "primary") and is_word(b, "key")
+        for a, b in zip(constraints, constraints[1:])
+    )
+    # A PRIMARY KEY DESC column is not an alias for the rowid, a quirk
+    # kept by SQLite for backwards compatibility.
+    descending = any(is_word(t, "desc") for t in constraints)
+    is_alias = primary_key and declared_type.upper() == "INTEGER" and not descending
+    collations = [
+        b[1] for a, b in zip(constraints, constraints[1:]) if is_word(a, "collate")
+    ]
+    collation = collations[-1].upper() if collations else "BINARY"
+    return name, declared_type, collation, is_alias
+
+
+def parse_create_table(sql):
+    """Parse a CREATE TABLE statement into its columns, their declared types
+    and collations, and the column that aliases the rowid, if any."""
+    tokens = tokenize(sql)
+    groups, _ = split_parenthesised(tokens, tokens.index(("operator", "(")))
+    columns, types, collations, rowid_alias = [], [], [], None
+    for group in groups:
+        if is_word(group[0], *TABLE_CONSTRAINT_WORDS):
+            if is_word(group[0], "constraint"):
+                group = group[2:]  # Skip CONSTRAINT name.
+            # A table constraint PRIMARY KEY (x) on a single INTEGER column
+            # also makes that column an alias for the rowid.
+            if is_word(group[0], "primary"):
+                key_columns, _ = split_parenthesised(
+                    group, group.index(("operator", "("))
+                )
+                if len(key_columns) == 1:
+                    key_column = key_columns[0][0][1]
+                    if key_column in columns:
+                        i = columns.index(key_column)
+                        if types[i].upper() == "INTEGER":
+                            rowid_alias = key_column
+            continue
+        name, declared_type, collation, is_alias = parse_column_definition(group)
+        columns.append(name)
+        types.append(declared_type)
+        collations.append(collation)
+        if is_alias:
+            rowid_alias = name
+    return {
+        "columns": columns,
+        "types": types,
+        "collations": collations,
+        "rowid_alias": rowid_alias,
+    }
+
+
+def parse_create_index(sql):
+    """Parse a CREATE INDEX statement into its columns, and whether it is
+    a partial index. Indexed expressions are given as None."""
+    tokens = tokenize(sql)
+    groups, end = split_parenthesised(tokens, tokens.index(("operator", "(")))
+    columns = []
+    for group in groups:
+        # A column may be followed by COLLATE name and ASC/DESC. Columns with
+        # a collation other than BINARY, or in descending order, are not
+        # ordered by ascending value, so they are treated like expressions.
+        collations = [b for a, b in zip(group, group[1:]) if is_word(a, "collate")]
+        plain = len(group) == 1 or is_word(group[1], "collate", "asc")
+        if (
+            group[0][0] == "identifier"
+            and plain
+            and all(is_word(c, "binary") for c in collations)
+            and not any(is_word(t, "desc") for t in group)
+        ):
+            columns.append(group[0][1])
+        else:
+            columns.append(None)
+    partial = any(is_word(t, "where") for t in tokens[end:])
+    return {"columns": columns, "partial": partial}
+
+
+# END
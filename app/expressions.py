@@ -0,0 +1,460 @@
+import operator
+import re
+
+# -- Tokenizer.
+#    Tokens are (kind, value) pairs, where kind is one of "string", "number",
+#    "identifier", "keyword" or "operator". Keywords are lower-cased.
+
+
+KEYWORDS = {
+    "and",
+    "or",
+    "not",
+    "in",
+    "between",
+    "is",
+    "null",
+    "select",
+    "from",
+    "where",
+    "group",
+    "by",
+    "order",
+    "asc",
+    "desc",
+    "limit",
+    "offset",
+}
+
+TOKEN_PATTERN = re.compile(
+    r"""(?:\s+|--[^\n]*|/\*.*?(?:\*/|$))*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<word>[A-Za-z_][A-Za-z_0-9$]*)
+      | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+      | (?P<operator><=|>=|==|!=|<>|\|\||<<|>>|[=<>(),*\-+.;/%&|~])
+      | (?P<end>$)
+    )""",
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def tokenize(sql):
+    """Split SQL into tokens, dropping whitespace and comments."""
+    tokens = []
+    position = 0
+    while True:
+        match = TOKEN_PATTERN.match(sql, position)
+        if not match:
+            raise ValueError(f"Unexpected character in {sql!r} at {position}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "end":
+            return tokens
+        if kind == "string":
+            tokens.append(("string", value[1:-1].replace("''", "'")))
+        elif kind == "number":
+            tokens.append(("number", parse_number(value)))
+        elif kind == "word" and value.lower() in KEYWORDS:
+            tokens.append(("keyword", value.lower()))
+        elif kind == "word":
+            tokens.append(("identifier", value))
+        elif kind == "quoted":
+            tokens.append(("identifier", unquote_identifier(value)))
+        else:
+            tokens.append(("operator", value))
+
+
+def parse_number(literal):
+    try:
+        return int(literal)
+    except ValueError:
+        return float(literal)
+
+
+def unquote_identifier(identifier):
+    """Strip the quotes from "name", `name` or [name]."""
+    if identifier[0] == "[":
+        return identifier[1:-1]
+    quote = identifier[0]
+    return identifier[1:-1].replace(quote * 2, quote)
+
+
+# END
+
+
+# -- Parser.
+#    Expressions are parsed into nested tuples:
+#      ("column", name)
+#      ("literal", value)
+#      ("compare", operator, left, right)   operator is one of = != < <= > >=
+#      ("in", expr, values, negated)        values is a tuple of literals
+#      ("between", expr, lo, hi, negated)
+#      ("is null", expr, negated)
+#      ("and", left, right)
+#      ("or", left, right)
+
+
+COMPARISON_OPERATORS = {
+    "=": "=",
+    "==": "=",
+    "!=": "!=",
+    "<>": "!=",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+}
+
+
+class Parser:
+    """A recursive descent parser over a list of tokens.
+    Precedence, loosest first: OR, AND, comparisons, unary minus."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, kind, value):
+        if self.peek() == (kind, value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind, value):
+        if not self.accept(kind, value):
+            raise ValueError(f"Expected {value!r}, got {self.peek()[1]!r}")
+
+    def expect_end(self):
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected {self.peek()[1]!r}")
+
+    def parse_or(self):
+        left = self.parse_and()
+        while self.accept("keyword", "or"):
+            left = ("or", left, self.parse_and())
+        return left
+
+    def parse_and(self):
+        left = self.parse_comparison()
+        while self.accept("keyword", "and"):
+            left = ("and", left, self.parse_comparison())
+        return left
+
+    def parse_comparison(self):
+        left = self.parse_operand()
+        kind, value = self.peek()
+        if kind == "operator" and value in COMPARISON_OPERATORS:
+            self.next()
+            return ("compare", COMPARISON_OPERATORS[value], left, self.parse_operand())
+        if self.accept("keyword", "is"):
+            negated = self.accept("keyword", "not")
+            self.expect("keyword", "null")
+            return ("is null", left, negated)
+        negated = self.accept("keyword", "not")
+        if self.accept("keyword", "in"):
+            self.expect("operator", "(")
+            values = [self.parse_literal()]
+            while self.accept("operator", ","):
+                values.append(self.parse_literal())
+            self.expect("operator", ")")
+            return ("in", left, tuple(values), negated)
+        if self.accept("keyword", "between"):
+            lo = self.parse_operand()
+            self.expect("keyword", "and")
+            return ("between", left, lo, self.parse_operand(), negated)
+        if negated:
+            raise ValueError("Expected IN or BETWEEN after NOT")
+        return left
+
+    def parse_operand(self):
+        if self.accept("operator", "("):
+            expr = self.parse_or()
+            self.expect("operator", ")")
+            return expr
+        kind, value = self.peek()
+        if kind == "identifier":
+            self.next()
+            return ("column", value)
+        return ("literal", self.parse_literal())
+
+    def parse_literal(self):
+        kind, value = self.next()
+        if kind in ("string", "number"):
+            return value
+        if (kind, value) == ("keyword", "null"):
+            return None
+        if (kind, value) == ("operator", "-"):
+            kind, value = self.next()
+            if kind == "number":
+                return -value
+        raise ValueError(f"Expected a literal, got {value!r}")
+
+
+def conjuncts(expr):
+    """Return the list of expressions that are ANDed together in expr."""
+    if expr[0] == "and":
+        return conjuncts(expr[1]) + conjuncts(expr[2])
+    return [expr]
+
+
+# END
+
+
+# -- Type affinity.
+#    Refer to '3. Type Affinity' of https://www.sqlite.org/datatype3.html
+#    When a column is compared with a literal, the column's affinity is
+#    applied to the literal before comparing, so that age > '18' compares
+#    numbers and name = 5 compares text.
+
+
+def column_affinity(declared_type):
+    """Return the affinity of a column from its declared type."""
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return "INTEGER"
+    if any(s in declared_type for s in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if "BLOB" in declared_type or not declared_type:
+        return "BLOB"
+    if any(s in declared_type for s in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+NUMBER_PATTERN = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+
+def apply_affinity(affinity, value):
+    """Convert a literal as it would be if stored in a column of that affinity."""
+    if affinity in ("INTEGER", "REAL", "NUMERIC") and isinstance(value, str):
+        if not NUMBER_PATTERN.fullmatch(value.strip()):
+            return value
+        number = parse_number(value.strip())
+        if affinity == "REAL":
+            return float(number)
+        if isinstance(number, float) and number.is_integer():
+            return int(number)
+        return number
+    if affinity == "TEXT" and isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def apply_affinities(expr, affinities):
+    """Return expr with the affinity of each column applied to the literals
+    it is compared with. affinities maps lower-cased column names to
+    affinities."""
+
+    def coerce(column, literal):
+        affinity = affinities.get(column[1].lower()) if column[0] == "column" else None
+        if affinity and literal[0] == "literal":
+            return ("literal", apply_affinity(affinity, literal[1]))
+        return literal
+
+    match expr:
+        case ("compare", op, left, right):
+            return ("compare", op, coerce(right, left), coerce(left, right))
+        case ("in", operand, values, negated):
+            if operand[0] == "column" and operand[1].lower() in affinities:
+                affinity = affinities[operand[1].lower()]
+                values = tuple(apply_affinity(affinity, v) for v in values)
+            return ("in", operand, values, negated)
+        case ("between", operand, lo, hi, negated):
+            return (
+                "between",
+                operand,
+                coerce(operand, lo),
+                coerce(operand, hi),
+                negated,
+            )
+        case ("and" | "or" as op, left, right):
+            return (
+                op,
+                apply_affinities(left, affinities),
+                apply_affinities(right, affinities),
+            )
+    return expr
+
+
+# END
+
+
+# -- Compiler.
+#    Expressions are compiled once into closures over a row (a list of
+#    column values), so no parsing or dispatch on the expression happens
+#    per row. Predicates follow SQL's three-valued logic loosely: any
+#    comparison involving NULL is None, which is falsy like False.
+
+
+# The order of values of different storage classes.
+# Refer to '4.1. Sort Order' of https://www.sqlite.org/datatype3.html
+STORAGE_CLASS = {type(None): 0, bool: 1, int: 1, float: 1, str: 2, bytes: 3}
+
+OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def compare(op, x, y):
+    """Compare two non-NULL values. Values of different storage classes
+    are ordered by class, so 1 < 'a' < b'a'."""
+    x_class, y_class = STORAGE_CLASS[type(x)], STORAGE_CLASS[type(y)]
+    if x_class == y_class:
+        return op(x, y)
+    return op(x_class, y_class)
+
+
+def sort_key(value):
+    """Key to sort values as SQLite does: NULLs, then numbers, text, BLOBs."""
+    return (STORAGE_CLASS[type(value)], value)
+
+
+def compile_value(expr, column_indices):
+    """Compile an operand into a function of the row."""
+    match expr:
+        case ("column", name):
+            i = column_index(name, column_indices)
+            return lambda row: row[i]
+        case ("literal", value):
+            return lambda row: value
+    raise ValueError(f"Expected a column or a literal, got {expr[0]}")
+
+
+def column_index(name, column_indices):
+    """Return the index in the row of a column. column_indices is keyed by
+    lower-cased name, as column names are matched without regard to case."""
+    try:
+        return column_indices[name.lower()]
+    except KeyError:
+        raise ValueError(f"No such column: {name}") from None
+
+
+def compile_compare(op, left, right, column_indices):
+    op = OPERATORS[op]
+    # The common case of a column compared with a literal is specialised,
+    # so that each row costs one index, one type lookup and one comparison.
+    if left[0] == "literal" and right[0] == "column":
+        op = {operator.lt: operator.gt, operator.gt: operator.lt}.get(op, op)
+        op = {operator.le: operator.ge, operator.ge: operator.le}.get(op, op)
+        left, right = right, left
+    if left[0] == "column" and right[0] == "literal":
+        i = column_index(left[1], column_indices)
+        value = right[1]
+        if value is None:
+            return lambda row: None
+        value_class = STORAGE_CLASS[type(value)]
+
+        def compare_column(row):
+            x = row[i]
+            if x is None:
+                return None
+            x_class = STORAGE_CLASS[type(x)]
+            if x_class == value_class:
+                return op(x, value)
+            return op(x_class, value_class)
+
+        return compare_column
+
+    left = compile_value(left, column_indices)
+    right = compile_value(right, column_indices)
+
+    def compare_values(row):
+        x, y = left(row), right(row)
+        if x is None or y is None:
+            return None
+        return compare(op, x, y)
+
+    return compare_values
+
+
+def compile_expression(expr, column_indices):
+    """Compile a parsed expression into a predicate: a function of the row
+    that is truthy when the row matches."""
+    match expr:
+        case ("compare", op, left, right):
+            return compile_compare(op, left, right, column_indices)
+        case ("and", left, right):
+            left = compile_expression(left, column_indices)
+            right = compile_expression(right, column_indices)
+            return lambda row: left(row) and right(row)
+        case ("or", left, right):
+            left = compile_expression(left, column_indices)
+            right = compile_expression(right, column_indices)
+            return lambda row: left(row) or right(row)
+        case ("is null", operand, negated):
+            value = compile_value(operand, column_indices)
+            if negated:
+                return lambda row: value(row) is not None
+            return lambda row: value(row) is None
+        case ("in", operand, values, negated):
+            return compile_in(operand, values, negated, column_indices)
+        case ("between", operand, lo, hi, negated):
+            low = compile_compare(">=", operand, lo, column_indices)
+            high = compile_compare("<=", operand, hi, column_indices)
+            if negated:
+                return lambda row: low(row) is False or high(row) is False
+            return lambda row: low(row) and high(row)
+        case ("column", _) | ("literal", _):
+            value = compile_value(expr, column_indices)
+            return lambda row: bool(value(row))
+    raise ValueError(f"Cannot compile expression {expr}")
+
+
+def compile_in(operand, values, negated, column_indices):
+    value = compile_value(operand, column_indices)
+    has_null = None in values
+    # Match on storage class as well as value, so that 1 is not IN ('1').
+    members = frozenset((STORAGE_CLASS[type(v)], v) for v in values if v is not None)
+
+    def is_in(row):
+        x = value(row)
+        if x is None:
+            return None
+        if (STORAGE_CLASS[type(x)], x) in members:
+            return not negated
+        return None if has_null else negated
+
+    return is_in
+
+
+def expression_columns(expr):
+    """Return the set of column names that an expression reads."""
+    match expr:
+        case ("column", name):
+            return {name}
+        case ("literal", _):
+            return set()
+        case ("compare", _, left, right):
+            return expression_columns(left) | expression_columns(right)
+        case ("in", operand, _, _) | ("is null", operand, _):
+            # The values of an IN list are literals, not expressions.
+            return expression_columns(operand)
+        case ("between", operand, lo, hi, _):
+            return (
+                expression_columns(operand)
+                | expression_columns(lo)
+                | expression_columns(hi)
+            )
+        case ("and" | "or", left, right):
+            return expression_columns(left) | expression_columns(right)
+    raise ValueError(f"Cannot find the columns of expression {expr}")
+
+
+# END
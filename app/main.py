@@ -1,10 +1,32 @@
+import argparse
+import itertools
+import multiprocessing
+import struct
 import sys
-import sqlparse
-from itertools import compress
-
-from .select import parse_select, make_predicate
-from .utils import combine_dicts
-from .serial_types import read_serial, serial_type_from_int
+import time
+
+from .aggregate import aggregate, is_aggregate
+from .catalog import Catalog, database_identity
+from .output import OUTPUT_BATCH_ROWS, OUTPUT_FORMATS, open_sink
+from .overflow import (
+    Payload,
+    local_payload_size,
+    materialize,
+    read_payload_column,
+)
+from .pager import Pager, page_size_from_header
+from .expressions import (
+    apply_affinities,
+    column_affinity,
+    compile_expression,
+    conjuncts,
+    expression_columns,
+    sort_key,
+)
+from .select import parse_select
+from .sort import SORT_RUN_ROWS, external_sort, make_order_key, top_k
+from .stats import STATS, format_stats
+from .serial_types import read_serial, serial_type_size
 from .varint import read_varint
 
 # -- Constants.
@@ -17,6 +39,9 @@ LEAF_PAGE_HEADER_BYTES = 8
 PAGE_SIZE_OFFSET = 16
 CELL_COUNT_OFFSET = 3
 
+# Number of parsed and compiled statements kept, see cached_statement.
+STATEMENT_CACHE_SIZE = 256
+
 
 # END
 
@@ -24,21 +49,37 @@ CELL_COUNT_OFFSET = 3
 # -- Database and page headers.
 
 
+def open_database(database_file_path):
+    """Open the database and set up the module level state that the rest
+    of this module reads: the pager and the database header."""
+    global DATABASE_FILE_PATH, PAGER, DATABASE_HEADER, PAGESIZE, USABLE_SIZE
+    DATABASE_FILE_PATH = database_file_path
+    PAGER = Pager(DATABASE_FILE_PATH)
+    DATABASE_HEADER = read_database_header()
+    PAGESIZE = DATABASE_HEADER["page_size"]
+    # Extensions may reserve space at the end of each page.
+    USABLE_SIZE = PAGESIZE - DATABASE_HEADER["reserved_space"]
+    assert DATABASE_HEADER["text_encoding"] == 1  # Assert we are UTF-8
+
+
 def read_database_header():
-    with open(DATABASE_FILE_PATH, "rb") as db_file:
-        data = db_file.read(DATABASE_HEADER_BYTES)
-        # Refer to '1.3. The Database Header' for the offsets/lengths.
-        return {
-            "magic_header_string": data[:16],
-            "page_size": int.from_bytes(data[16:18]),
-            "text_encoding": int.from_bytes(data[56:60]),
-            # Extend this parsing as needed.
-        }
+    data = PAGER.read(0, DATABASE_HEADER_BYTES)
+    # Refer to '1.3. The Database Header' for the offsets/lengths.
+    return {
+        "magic_header_string": bytes(data[:16]),
+        "page_size": page_size_from_header(data[16:18]),
+        "reserved_space": data[20],
+        "file_change_counter": int.from_bytes(data[24:28]),
+        "schema_cookie": int.from_bytes(data[40:44]),
+        "text_encoding": int.from_bytes(data[56:60]),
+        # Extend this parsing as needed.
+    }
 
 
 def read_page_header(page, skip_db_header=False):
     if skip_db_header:
         page = page[DATABASE_HEADER_BYTES:]
+    STATS.pages[page[0]] += 1
     page_type = page[:1]
     interior = page_type in b"\x02\x05"
     header = {
@@ -58,26 +99,21 @@ def read_page_header(page, skip_db_header=False):
 
 
 def page_bytes(page_number):
-    """Read the page. Note that they start counting at 1.
-    This function simply returns the bytes holding the page data."""
-    with open(DATABASE_FILE_PATH, "rb") as db_file:
-        db_file.seek(PAGESIZE * (page_number - 1))
-        return db_file.read(PAGESIZE)
+    """Return the page. Note that they start counting at 1.
+    Pages are served by the shared pager, as memoryviews of the page data."""
+    return PAGER.page(page_number)
 
 
 def read_cell_pointer_offsets(page, page_header, skip_db_header=False):
     """Return a list of cell pointer offsets.
     Note that these are absolute (i.e. not relative to the page being read.)"""
-    if skip_db_header:
-        page = page[DATABASE_HEADER_BYTES:]
+    start = DATABASE_HEADER_BYTES if skip_db_header else 0
     if page_header["page_type"] in b"\x0d\x0a":
-        page = page[LEAF_PAGE_HEADER_BYTES:]
+        start += LEAF_PAGE_HEADER_BYTES
     else:
-        page = page[INTERIOR_PAGE_HEADER_BYTES:]
-    offsets = []
-    for i in range(page_header["n_cells"]):
-        offsets.append(int.from_bytes(page[i * 2 : (i + 1) * 2]))
-    return offsets
+        start += INTERIOR_PAGE_HEADER_BYTES
+    # The cell pointer array is a run of big-endian 2 byte integers.
+    return list(struct.unpack_from(f">{page_header['n_cells']}H", page, start))
 
 
 # END
@@ -86,123 +122,514 @@ def read_cell_pointer_offsets(page, page_header, skip_db_header=False):
 # -- Read a single table B-tree leaf cell.
 
 
-def read_table_btree_leaf_cell_header(payload):
-    """Helper function for read_table_btree_leaf_cell."""
-    size, _ = read_varint(payload)
-    header = payload[:size]
-    # Drop the header size from the header, since we already have it
-    # and are collecting serial types now.
-    _, header = read_varint(header)
+def read_record_header(data, offset):
+    """Read the header of the record starting at offset in data.
+    Return the serial types of its columns and the offset of the record body."""
+    header_size, i = read_varint(data, offset)
+    body = offset + header_size
     serial_types = []
-    while header:
-        n, header = read_varint(header)
-        serial_types.append(serial_type_from_int(n))
-    return size, serial_types
+    while i < body:
+        n, i = read_varint(data, i)
+        serial_types.append(n)
+    return serial_types, body
 
 
-def read_table_btree_leaf_cell_body(rowid, data, serial_types):
-    """Helper function for read_table_btree_leaf_cell."""
+def read_record_body(data, offset, serial_types):
+    """Decode the values of the record body starting at offset in data,
+    given the serial types from its header."""
     values = []
-    for st in serial_types:
-        values.append(read_serial(st, data))
-        _, bytes_consumed = st
-        data = data[bytes_consumed:]
-    values[0] = rowid
+    for n in serial_types:
+        values.append(read_serial(n, data, offset))
+        offset += serial_type_size(n)
     return values
 
 
-def read_table_btree_leaf_cell(page, offset):
+def record_column_offsets(body, serial_types):
+    """Return the offset of each column of a record body. Only the sizes of
+    the serial types are needed, so no column is decoded to find them."""
+    offsets = []
+    for n in serial_types:
+        offsets.append(body)
+        body += serial_type_size(n)
+    return offsets
+
+
+def read_table_btree_leaf_cell(page, offset, columns=None, where=None, layout=None):
     """Return the data held by the cell at the given offset.
     That is, return a list containing the valus in the corresponding row of the database.
+    The record is decoded in place, without copying the page.
+
+    If layout is given, it is (width, rowid column) from get_row_layout.
+    Records written before columns were added to the table (by ALTER TABLE
+    ADD COLUMN) are short, and the missing columns are read as NULL up to
+    the width. The rowid is put in the row at the rowid column: the column
+    that aliases it (an INTEGER PRIMARY KEY), which is stored as NULL in the
+    record, or else the pseudo-column after the last.
+
+    If columns is given, only the columns at those indices are decoded and
+    the rest of the row is left as None. If where is given, it is a pair of
+    (column indices, predicate). Those columns are decoded first, and if the
+    predicate rejects the partial row None is returned without decoding any more.
+
+    If the payload spills onto overflow pages, they are only read for the
+    columns stored there, and large TEXT/BLOB values among the columns are
+    returned as OverflowValues, which read their pages when used.
     """
-    payload_size, rest = read_varint(page[offset:])
-    rowid, rest = read_varint(rest)
-    # Here is where you check if the payload spills onto overflow
-    # pages. This is a calculation involving the pagesize, the offset
-    # of this cell, the number of bytes used by the first two varints
-    # and the size of the payload.
-    # For now assume that there is no overflow.
-    payload = rest[:payload_size]
-    header_size, serial_types = read_table_btree_leaf_cell_header(payload)
-    return read_table_btree_leaf_cell_body(rowid, payload[header_size:], serial_types)
+    payload_size, offset = read_varint(page, offset)
+    rowid, offset = read_varint(page, offset)
+    local_size = local_payload_size(payload_size, USABLE_SIZE, table_leaf=True)
+    if local_size < payload_size:
+        payload = Payload(PAGER, page, offset, payload_size, local_size, USABLE_SIZE)
+        header_size, _ = read_varint(page, offset)
+        # Offsets are relative to the start of the payload from here on.
+        serial_types, body = read_record_header(payload.read(0, header_size), 0)
+    else:
+        payload = None
+        serial_types, body = read_record_header(page, offset)
+    column_offsets = record_column_offsets(body, serial_types)
+    STATS.cells_decoded += 1
+    if layout is not None:
+        width, rowid_column = layout
+        if len(serial_types) < width:
+            serial_types += [0] * (width - len(serial_types))
+    values = [None] * len(serial_types)
+    if layout is not None:
+        values[rowid_column] = rowid
+    if where:
+        where_columns, predicate = where
+        STATS.columns_decoded += len(where_columns)
+        for i in where_columns:
+            if not serial_types[i]:
+                continue
+            if payload is None:
+                values[i] = read_serial(serial_types[i], page, column_offsets[i])
+            else:
+                values[i] = read_payload_column(
+                    payload, serial_types[i], column_offsets[i]
+                )
+        if not predicate(values):
+            return None
+    decoded = 0
+    for i in range(len(serial_types)) if columns is None else columns:
+        # NULLs (serial type 0) and the WHERE columns are already in place.
+        if not serial_types[i] or values[i] is not None:
+            continue
+        decoded += 1
+        if payload is None:
+            values[i] = read_serial(serial_types[i], page, column_offsets[i])
+        else:
+            values[i] = read_payload_column(
+                payload, serial_types[i], column_offsets[i], lazy=True
+            )
+    STATS.columns_decoded += decoded
+    return values
+
+
+def read_table_btree_leaf_cell_rowid(page, offset):
+    """Return just the rowid of the cell at the given offset."""
+    _, offset = read_varint(page, offset)
+    rowid, _ = read_varint(page, offset)
+    return rowid
 
 
 # END
 
 
 # -- Table reading utils.
+#    The schema comes from the catalog, which is read from sqlite_master
+#    once per process (or loaded from its on-disk cache).
 
 
 def schema_table_rows():
-    page_header = read_page_header(SCHEMA_PAGE, True)
-    offsets = read_cell_pointer_offsets(SCHEMA_PAGE, page_header, True)
-    return (read_table_btree_leaf_cell(SCHEMA_PAGE, o) for o in offsets)
-
-
-def count_rows(page):
-    header = read_page_header(page)
-    return len(read_cell_pointer_offsets(page, header))
+    """Yield the rows of sqlite_master, whose B-tree is rooted at page 1."""
+    return ([materialize(value) for value in row] for row in scan(1))
+
+
+def load_catalog(cache_path=None):
+    """Return the catalog, from the cache at cache_path if it is given and
+    up to date, and otherwise by reading sqlite_master (updating the cache).
+    Statements cached for an earlier catalog are dropped."""
+    global STATEMENTS
+    STATEMENTS = {}
+    schema_cookie = DATABASE_HEADER["schema_cookie"]
+    if cache_path:
+        database = database_identity(DATABASE_FILE_PATH)
+        catalog = Catalog.load(cache_path, database, schema_cookie)
+        if catalog:
+            return catalog
+    catalog = Catalog.from_schema_rows(schema_cookie, schema_table_rows())
+    if cache_path:
+        catalog.save(cache_path, database)
+    return catalog
 
 
 def get_rootpage_number(table_name):
-    schema_table_row = next(r for r in schema_table_rows() if r[2] == table_name)
-    return schema_table_row[3]
+    return CATALOG.table(table_name)["rootpage"]
+
+
+def get_indexes(table_name):
+    """Return a list of (rootpage, column names) for the indexes on a table
+    that can be searched by value. Partial indexes don't hold every row, so
+    they are left out. Columns declared with a collation other than BINARY
+    are compared (and indexed) by it, e.g. NOCASE, so they are given as None,
+    like indexed expressions. Column names are lower-cased, as they are
+    matched without regard to case."""
+    table = CATALOG.table(table_name)
+    collations = {c.lower(): k for c, k in zip(table["columns"], table["collations"])}
+    return [
+        (
+            index["rootpage"],
+            [
+                c.lower() if c and collations.get(c.lower()) == "BINARY" else None
+                for c in index["columns"]
+            ],
+        )
+        for index in CATALOG.table_indexes(table_name)
+        if index["columns"] and not index["partial"]
+    ]
 
 
 def get_column_names(table_name):
-    schema_table_row = next(r for r in schema_table_rows() if r[2] == table_name)
-    table_sql = schema_table_row[-1]
-    table_sql = list(sqlparse.parse(table_sql)[0])
-    cols = next(token for token in table_sql if token.value.startswith("("))
-    cols = cols.value[1:-1].split(",")
-    cols = [c.strip().split(" ") for c in cols]
-    col_names = [c[0] for c in cols]
-    return col_names
+    return CATALOG.table(table_name)["columns"]
 
 
-# END
+def get_column_indices(table_name):
+    """Return a dict from lower-cased column name to index in the row, as
+    column names are matched without regard to case. The rowid can be
+    referred to as rowid, oid or _rowid_, unless a column has that name."""
+    column_names = get_column_names(table_name)
+    column_indices = {name.lower(): i for i, name in enumerate(column_names)}
+    for name in ("rowid", "oid", "_rowid_"):
+        column_indices.setdefault(name, get_rowid_column(table_name))
+    return column_indices
 
 
-# -- Read a B-tree table.
-#    This section really just contains a standard b-tree traversal, with the
-#    traversal logic for interior/leaf nodes defined outside the main function.
+def get_column_types(table_name):
+    """Return the declared type of each column, e.g. "integer" or "varchar(20)"."""
+    return CATALOG.table(table_name)["types"]
 
 
-def read_btree_leaf(page_number, table_name):
-    """Read the cells on a table B-tree leaf page."""
-    page = page_bytes(page_number)
-    header = read_page_header(page)
-    cpos = read_cell_pointer_offsets(page, header)
-    table = [read_table_btree_leaf_cell(page, o) for o in cpos]
+def get_real_columns(table_name):
+    """Return the indices of the columns with REAL affinity."""
+    types = get_column_types(table_name)
+    return {i for i, t in enumerate(types) if column_affinity(t) == "REAL"}
+
+
+def get_rowid_column(table_name):
+    """Return the index in the row of the rowid: that of the column that
+    aliases it (the INTEGER PRIMARY KEY) if there is one, and otherwise of
+    a pseudo-column after the last, which the cell reader fills in."""
     column_names = get_column_names(table_name)
-    return dict(zip(column_names, zip(*table)))
+    rowid_alias = CATALOG.table(table_name)["rowid_alias"]
+    if rowid_alias is None:
+        return len(column_names)
+    return column_names.index(rowid_alias)
+
+
+def get_row_layout(table_name):
+    """Return (width, rowid column) of the rows read from a table, for the
+    cell reader: every column and the rowid pseudo-column, and the index
+    the rowid goes at."""
+    return len(get_column_names(table_name)) + 1, get_rowid_column(table_name)
+
+
+def get_rowid_names(table_name):
+    """Return the names that refer to the rowid in a table."""
+    rowid_column = get_rowid_column(table_name)
+    return {n for n, i in get_column_indices(table_name).items() if i == rowid_column}
+
+
+# END
+
+
+# -- Read a B-tree table.
+#    This section contains a standard b-tree traversal, and seeks that use
+#    the keys on interior pages to visit only part of the tree. All of them
+#    are generators, so rows are produced one at a time.
 
 
 def read_table_btree_interior_cell(page, offset):
     left_child = int.from_bytes(page[offset : offset + 4])
-    key, _ = read_varint(page[offset + 4 :])
+    key, _ = read_varint(page, offset + 4)
     return left_child, key
 
 
-def traverse(page_number, table_name):
-    """Recrursive traversal of a B-Tree"""
+def scan(page_number, columns=None, where=None, reverse=False, layout=None):
+    """Recursive traversal of a B-Tree, yielding rows one at a time in
+    rowid order, or in reverse if reverse is set. Only the pages on the path
+    to the current leaf are held.
+    Rows are decoded and filtered as in read_table_btree_leaf_cell."""
     page = page_bytes(page_number)
-    header = read_page_header(page)
+    # Page 1 (the root of sqlite_master) starts with the database header.
+    skip_db_header = page_number == 1
+    header = read_page_header(page, skip_db_header)
+    offsets = read_cell_pointer_offsets(page, header, skip_db_header)
+    if reverse:
+        offsets.reverse()
 
     if header["page_type"] == 13:  # leaf
-        return read_btree_leaf(page_number, table_name)
+        for cpo in offsets:
+            row = read_table_btree_leaf_cell(page, cpo, columns, where, layout)
+            if row is not None:
+                yield row
     elif header["page_type"] == 5:  # interior
-        chunks = []
-        for cpo in read_cell_pointer_offsets(page, header):
+        right_most_child = int.from_bytes(header["right_most_pointer"])
+        if reverse:
+            yield from scan(right_most_child, columns, where, reverse, layout)
+        for cpo in offsets:
             left_child, key = read_table_btree_interior_cell(page, cpo)
-            chunks.append(traverse(left_child, table_name))
-        return combine_dicts(chunks)
+            yield from scan(left_child, columns, where, reverse, layout)
+        if not reverse:
+            yield from scan(right_most_child, columns, where, reverse, layout)
+    else:
+        raise ValueError(
+            f"Page type must be 13 (leaf) or 5 (interior), got {header['page_type']}"
+        )
+
+
+def seek_rows(
+    page_number, lo, hi, columns=None, where=None, reverse=False, layout=None
+):
+    """Yield the rows with lo <= rowid <= hi, in rowid order, or in reverse
+    if reverse is set.
+    Interior cells hold the largest rowid of their left child, so each page
+    is binary searched for the first subtree that can hold lo, and the walk
+    stops at the first subtree that reaches past hi. The right-most pointer
+    holds the rowids greater than every key on the page. Backwards, the walk
+    starts at the subtree that can hold hi and stops once the keys are
+    below lo."""
+    page = page_bytes(page_number)
+    header = read_page_header(page)
+    offsets = read_cell_pointer_offsets(page, header)
+    args = (lo, hi, columns, where, reverse, layout)
+
+    if header["page_type"] == 13:  # leaf
+        rowid = lambda o: read_table_btree_leaf_cell_rowid(page, o)
+        if reverse:
+            # Cells up to the first one past hi, last first.
+            cells = reversed(offsets[: bisect_cells(offsets, rowid, hi + 1)])
+        else:
+            cells = offsets[bisect_cells(offsets, rowid, lo) :]
+        for offset in cells:
+            if not lo <= rowid(offset) <= hi:
+                return
+            row = read_table_btree_leaf_cell(page, offset, columns, where, layout)
+            if row is not None:
+                yield row
+    elif header["page_type"] == 5:  # interior
+        key = lambda o: read_table_btree_interior_cell(page, o)[1]
+        right_most_child = int.from_bytes(header["right_most_pointer"])
+        if reverse:
+            # Child i is the left child of cell i, or the right-most child
+            # for i == len(offsets). Those before child i hold rowids up to
+            # the key of cell i - 1.
+            for i in range(bisect_cells(offsets, key, hi), -1, -1):
+                if i == len(offsets):
+                    yield from seek_rows(right_most_child, *args)
+                else:
+                    left_child, _ = read_table_btree_interior_cell(page, offsets[i])
+                    yield from seek_rows(left_child, *args)
+                if i and key(offsets[i - 1]) < lo:
+                    return
+            return
+        for offset in offsets[bisect_cells(offsets, key, lo) :]:
+            left_child, cell_key = read_table_btree_interior_cell(page, offset)
+            yield from seek_rows(left_child, *args)
+            if cell_key >= hi:
+                return
+        yield from seek_rows(right_most_child, *args)
     else:
         raise ValueError(
             f"Page type must be 13 (leaf) or 5 (interior), got {header['page_type']}"
         )
 
 
+def bisect_cells(offsets, key, target):
+    """Return the index of the first cell whose key is >= target.
+    The key function is only called on the O(log n) cells that are probed."""
+    lo, hi = 0, len(offsets)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(offsets[mid]) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+# END
+
+
+# -- Read an index B-tree.
+#    Index records hold the indexed columns followed by the rowid, and the
+#    entries are ordered by those columns. Unlike table B-trees, the cells on
+#    interior pages are entries in their own right.
+
+
+def read_index_btree_cell(page, offset, interior):
+    """Return the values of the record held by an index cell."""
+    if interior:
+        offset += 4  # Skip the left child pointer.
+    payload_size, offset = read_varint(page, offset)
+    local_size = local_payload_size(payload_size, USABLE_SIZE, table_leaf=False)
+    if local_size < payload_size:
+        # The whole key is needed to compare it, so assemble it at once.
+        payload = Payload(PAGER, page, offset, payload_size, local_size, USABLE_SIZE)
+        page, offset = payload.read(0, payload_size), 0
+    serial_types, body = read_record_header(page, offset)
+    STATS.cells_decoded += 1
+    STATS.columns_decoded += len(serial_types)
+    return read_record_body(page, body, serial_types)
+
+
+def index_seek(page_number, value):
+    """Yield the rowids of the index entries whose first column equals value,
+    in index order. Each page is binary searched for the first candidate
+    entry, so a lookup touches O(log n + k) pages. Entries are ordered by
+    storage class and then value, as by sort_key."""
+    page = page_bytes(page_number)
+    header = read_page_header(page)
+    offsets = read_cell_pointer_offsets(page, header)
+    interior = header["page_type"] == 2
+    if header["page_type"] not in (2, 10):
+        raise ValueError(
+            f"Page type must be 10 (leaf) or 2 (interior), got {header['page_type']}"
+        )
+
+    target = sort_key(value)
+
+    def key(offset):
+        return sort_key(read_index_btree_cell(page, offset, interior)[0])
+
+    i = bisect_cells(offsets, key, target)
+    for offset in offsets[i:]:
+        if interior:
+            yield from index_seek(int.from_bytes(page[offset : offset + 4]), value)
+        values = read_index_btree_cell(page, offset, interior)
+        if sort_key(values[0]) != target:
+            return
+        yield values[-1]
+    if interior:
+        yield from index_seek(int.from_bytes(header["right_most_pointer"]), value)
+
+
+def index_rowids(page_number):
+    """Yield the rowids of every entry of an index, in index order."""
+    page = page_bytes(page_number)
+    header = read_page_header(page)
+    interior = header["page_type"] == 2
+    for offset in read_cell_pointer_offsets(page, header):
+        if interior:
+            yield from index_rowids(int.from_bytes(page[offset : offset + 4]))
+        yield read_index_btree_cell(page, offset, interior)[-1]
+    if interior:
+        yield from index_rowids(int.from_bytes(header["right_most_pointer"]))
+
+
+def count_btree_rows(page_number):
+    """Count the rows of a table B-tree by adding up the cell counts of its
+    leaf pages, without decoding any cells."""
+    page = page_bytes(page_number)
+    header = read_page_header(page)
+    if header["page_type"] == 13:  # leaf
+        return header["n_cells"]
+    return sum(count_btree_rows(child) for child in child_pages(page, header))
+
+
+def count_rows(page_number):
+    """Yield the one row of SELECT COUNT(*), counting when it is asked for
+    rather than when the query is planned."""
+    yield [count_btree_rows(page_number)]
+
+
+# END
+
+
+# -- Parallel scan.
+#    A full scan can be split into the disjoint subtrees under the root page
+#    (or under its children, if the root has too few). Each subtree is
+#    scanned, filtered and projected by a worker process with its own file
+#    handle, and the results are merged back in subtree order, which is
+#    rowid order.
+
+
+# Split into enough subtrees that the workers stay busy even when the
+# subtrees differ in size.
+SUBTREES_PER_JOB = 4
+
+
+def child_pages(page, header):
+    """Return the children of an interior table page in rowid order, given
+    the page and its header, so that the header isn't read (and counted)
+    twice."""
+    children = [
+        read_table_btree_interior_cell(page, cpo)[0]
+        for cpo in read_cell_pointer_offsets(page, header)
+    ]
+    children.append(int.from_bytes(header["right_most_pointer"]))
+    return children
+
+
+def split_btree(page_number, n_subtrees):
+    """Return the root pages of disjoint subtrees covering the B-tree, in
+    rowid order. The tree is split at the root, and at the second level
+    if that does not give n_subtrees."""
+    pages = [page_number]
+    for _ in range(2):
+        if len(pages) >= n_subtrees:
+            break
+        pages = [child for page in pages for child in subtree_pages(page)]
+    return pages
+
+
+def subtree_pages(page_number):
+    """Return the children of a table page, or just the page itself if it
+    is a leaf."""
+    page = page_bytes(page_number)
+    header = read_page_header(page)
+    if header["page_type"] != 5:
+        return [page_number]
+    return child_pages(page, header)
+
+
+def init_scan_worker(database_file_path):
+    open_database(database_file_path)
+
+
+def scan_subtree(task):
+    """Scan one subtree in a worker. The predicate is compiled here, since
+    closures can't be sent between processes. The worker's counters are
+    sent back with the rows, including those of its pager's cache."""
+    page_number, columns, where_expr, column_indices, layout = task
+    STATS.reset()
+    PAGER.hits = PAGER.misses = 0
+    where = compile_where(where_expr, column_indices)
+    rows = scan(page_number, columns, where, layout=layout)
+    rows = [[row[i] for i in columns] for row in rows]
+    return rows, STATS.as_dict(PAGER)
+
+
+def parallel_scan(page_number, columns, where_expr, column_indices, layout, jobs):
+    """Yield the given columns of the rows matching the WHERE clause, in
+    rowid order, scanning the B-tree with a pool of jobs processes."""
+    subtrees = split_btree(page_number, jobs * SUBTREES_PER_JOB)
+    if len(subtrees) == 1:
+        where = compile_where(where_expr, column_indices)
+        for row in scan(page_number, columns, where, layout=layout):
+            yield [row[i] for i in columns]
+        return
+    tasks = [(p, columns, where_expr, column_indices, layout) for p in subtrees]
+    with multiprocessing.Pool(
+        min(jobs, len(subtrees)),
+        initializer=init_scan_worker,
+        initargs=(DATABASE_FILE_PATH,),
+    ) as pool:
+        # imap returns results in task order, so rows stay in rowid order.
+        for rows, stats in pool.imap(scan_subtree, tasks):
+            STATS.merge(stats, PAGER)
+            yield from rows
+
+
 # END
 
 
@@ -212,74 +639,562 @@ def traverse(page_number, table_name):
 def handle_dbinfo():
     print(f"Magic string: {DATABASE_HEADER['magic_header_string']}")
     print(f"database page size: {DATABASE_HEADER['page_size']}")
-    print(f"number of tables: {SCHEMA_PAGE_HEADER['n_cells']}")
+    print(f"number of tables: {len(CATALOG.tables)}")
 
 
 def handle_tables():
-    table_names = [row[2] for row in schema_table_rows()]
+    table_names = [table["name"] for table in CATALOG.tables.values()]
     if "sqlite_sequence" in table_names:
         table_names.remove("sqlite_sequence")
     print(" ".join(table_names))
 
 
-# TODO: This is simple, but only works for single page tables.
-def handle_count(tbl_name):
-    rootpage_number = next(r for r in schema_table_rows() if r[2] == tbl_name)[3]
-    rootpage = page_bytes(rootpage_number)
-    print(count_rows(rootpage))
+def find_index(table_name, where_expr):
+    """If the WHERE clause requires equality on the first column of an index,
+    return (the value compared against, the index rootpage)."""
+    if not where_expr:
+        return None
+    indexes = get_indexes(table_name)
+    for expr in conjuncts(where_expr):
+        match expr:
+            case ("compare", "=", ("column", column_name), ("literal", value)):
+                pass
+            case ("compare", "=", ("literal", value), ("column", column_name)):
+                pass
+            case _:
+                continue
+        if value is None:
+            continue
+        for index_rootpage, index_columns in indexes:
+            if index_columns[0] == column_name.lower():
+                return value, index_rootpage
+    return None
+
+
+def find_rowid_range(table_name, where_expr):
+    """If the WHERE clause constrains the rowid, return the (lo, hi) bounds
+    of the rowids it can match. Every constraint on the rowid that is ANDed
+    into the clause narrows the bounds."""
+    if not where_expr:
+        return None
+    rowid_names = get_rowid_names(table_name)
+    lo, hi = float("-inf"), float("inf")
+    for expr in conjuncts(where_expr):
+        match expr:
+            case ("compare", op, ("column", name), ("literal", int() as value)):
+                pass
+            case ("compare", op, ("literal", int() as value), ("column", name)):
+                op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+            case (
+                "between",
+                ("column", name),
+                ("literal", int() as low),
+                ("literal", int() as high),
+                False,
+            ) if (
+                name.lower() in rowid_names
+            ):
+                lo, hi = max(lo, low), min(hi, high)
+                continue
+            case _:
+                continue
+        if name.lower() not in rowid_names:
+            continue
+        match op:
+            case "=":
+                lo, hi = max(lo, value), min(hi, value)
+            case ">":
+                lo = max(lo, value + 1)
+            case ">=":
+                lo = max(lo, value)
+            case "<":
+                hi = min(hi, value - 1)
+            case "<=":
+                hi = min(hi, value)
+    if (lo, hi) == (float("-inf"), float("inf")):
+        return None
+    return lo, hi
+
+
+def compile_where(where_expr, column_indices):
+    """Compile a parsed WHERE clause into the (indices of the columns it
+    reads, predicate) pair that is pushed down to the cell reader."""
+    if where_expr is None:
+        return None
+    predicate = compile_expression(where_expr, column_indices)
+    where_columns = {column_indices[c.lower()] for c in expression_columns(where_expr)}
+    return (sorted(where_columns), predicate)
+
+
+def plan_access(table_name, where_expr, jobs=1):
+    """Choose how to find the rows of a table that match the parsed WHERE
+    clause. If it constrains the rowid only the matching subtrees are
+    visited, if it is an equality on an indexed column the index is used,
+    and otherwise the whole B-Tree is scanned, by jobs worker processes if
+    that is more than one. Return one of ("rowid range", (lo, hi)),
+    ("index", (value, index rootpage)), ("parallel scan", jobs) or
+    ("scan", None)."""
+    rowid_range = find_rowid_range(table_name, where_expr)
+    if rowid_range:
+        return "rowid range", rowid_range
+    index = find_index(table_name, where_expr)
+    if index:
+        return "index", index
+    if jobs > 1:
+        return "parallel scan", jobs
+    return "scan", None
+
+
+def table_rows(table_name, where_expr, columns, jobs=1, order=None):
+    """Return an iterator over the given columns of the rows of a table that
+    match the parsed WHERE clause, found as chosen by plan_access.
+    The WHERE clause is compiled once and pushed down to the cell reader,
+    along with the columns to decode.
+
+    Rows come in rowid order, unless order (from plan_order) is "reverse",
+    for descending rowid order, or ("index", rootpage), for the order of
+    that index."""
+    rootpage_number = get_rootpage_number(table_name)
+    column_indices = get_column_indices(table_name)
+    layout = get_row_layout(table_name)
+    where, (access, argument) = cached_statement(
+        ("plan", table_name.lower(), where_expr, jobs),
+        lambda: (
+            compile_where(where_expr, column_indices),
+            plan_access(table_name, where_expr, jobs),
+        ),
+    )
+    # Rows are found backwards rather than reversed after, so that LIMIT can
+    # stop the walk early.
+    reverse = order == "reverse"
+    if reverse and access in ("scan", "parallel scan"):
+        access = "reverse scan"
+    if isinstance(order, tuple):
+        _, index_rootpage = order
+        rows = (
+            row
+            for rowid in index_rowids(index_rootpage)
+            for row in seek_rows(
+                rootpage_number, rowid, rowid, columns, where, False, layout
+            )
+        )
+    elif access == "rowid range":
+        lo, hi = argument
+        rows = seek_rows(rootpage_number, lo, hi, columns, where, reverse, layout)
+    elif access == "index":
+        column_value, index_rootpage = argument
+        # The entries for one value are in rowid order. Only their rowids
+        # are read in full to go backwards, not the rows.
+        rowids = index_seek(index_rootpage, column_value)
+        if reverse:
+            rowids = reversed(list(rowids))
+        rows = (
+            row
+            for rowid in rowids
+            for row in seek_rows(
+                rootpage_number, rowid, rowid, columns, where, False, layout
+            )
+        )
+    elif access == "parallel scan":
+        rows = parallel_scan(
+            rootpage_number, columns, where_expr, column_indices, layout, jobs
+        )
+    elif access == "reverse scan":
+        rows = scan(rootpage_number, columns, where, True, layout)
+    else:
+        rows = scan(rootpage_number, columns, where, layout=layout)
+    if access != "parallel scan":  # The workers project the rows themselves.
+        rows = ([row[i] for i in columns] for row in rows)
+    real_columns = get_real_columns(table_name)
+    real_positions = [p for p, i in enumerate(columns) if i in real_columns]
+    if real_positions:
+        rows = apply_real_affinity(rows, real_positions)
+    return rows
+
+
+def apply_real_affinity(rows, positions):
+    """Convert the integers at the given positions of each row to floats.
+    SQLite stores REAL values that are whole numbers as integers, to save
+    space, and converts them back when they are read."""
+    for row in rows:
+        for p in positions:
+            if type(row[p]) is int:
+                row[p] = float(row[p])
+        yield row
+
+
+def cached_statement(key, make):
+    """Return the cached statement (parse, or compiled predicate and plan)
+    for key, calling make to create it the first time. The cache lives as
+    long as the catalog it was made from, which matters in server mode."""
+    try:
+        return STATEMENTS[key]
+    except KeyError:
+        pass
+    if len(STATEMENTS) >= STATEMENT_CACHE_SIZE:
+        del STATEMENTS[next(iter(STATEMENTS))]  # Evict the oldest.
+    statement = STATEMENTS[key] = make()
+    return statement
+
+
+def parse_query(command):
+    """Parse a SELECT statement, and apply the declared column affinities to
+    its WHERE clause. Return (select exprs, table name, WHERE clause, group
+    by column names, order by terms, limit), as from parse_select."""
+    return cached_statement(("parse", command), lambda: parse_new_query(command))
+
+
+def parse_new_query(command):
+    parsed = parse_select(command)
+    select_exprs, table_name, condition, group_by, order_by, limit = parsed
+    where_expr = None
+    if condition:
+        column_names = get_column_names(table_name)
+        affinities = map(column_affinity, get_column_types(table_name))
+        affinities = dict(zip((c.lower() for c in column_names), affinities))
+        where_expr = apply_affinities(condition, affinities)
+    return select_exprs, table_name, where_expr, group_by, order_by, limit
 
 
-# TODO: Handle select *
-# TODO: Handle aggregate functions in select expressions. This would
-#       absorb the seperate handling of SELECT COUNT statements.
-def handle_select():
-    """Traverse a B-Tree and collect the rows, no index."""
-    select_exprs, table_name, condition = parse_select(COMMAND)
-    rootpage_number = get_rootpage_number(table_name)
-    table = traverse(rootpage_number, table_name)
+def is_count_star(select_exprs, where_expr, group_by):
+    return not where_expr and not group_by and select_exprs == [("count", "*")]
 
-    # Apply a WHERE... clause to the table
-    column_names = table.keys()
-    if condition:
-        col, predicate = make_predicate(condition)
-        includes = list(map(predicate, table[col]))
-        tmp = zip(*[table[k] for k in table])
-        tmp = compress(tmp, includes)
-        table = dict(zip(column_names, zip(*tmp)))
 
-    # Collect the columns that appear in the select_statement.
-    # This desing is future-proofed against applying functions
-    # in the select expressions.
-    table = {k: table[k] for k in (e[1] for e in select_exprs)}
-    table = zip(*table.values())
-    for row in table:
-        print("|".join((str(elem) for elem in row)))
+def column_position(table_name, column_name):
+    """Return the index in the row of a column, by name or rowid alias."""
+    try:
+        return get_column_indices(table_name)[column_name.lower()]
+    except KeyError:
+        raise ValueError(f"No such column: {column_name}") from None
 
 
-# END
+def is_aggregated(select_exprs, group_by):
+    return bool(group_by) or any(is_aggregate(f) for f, _ in select_exprs)
 
 
-if __name__ == "__main__":
+def plan_order(table_name, where_expr, select_exprs, group_by, order_by):
+    """
+    Work out how to produce the rows of a SELECT statement in the order of
+    its ORDER BY terms. Return (order, select exprs, sort terms), where
+    order is one of
+      None              the rows come out in that order anyway,
+      "reverse"         they are wanted in descending rowid order,
+      ("index", page)   they can be read in the order of the index rooted
+                        at that page, so there is nothing to sort,
+      "sort"            they have to be sorted.
+    To sort by terms that are not selected, they are appended to the select
+    exprs, to be dropped after sorting. The sort terms are (position in the
+    row, descending) pairs.
+    """
+    exprs = list(select_exprs)
+    terms = []
+    for term, descending in order_by:
+        if term[0] == "position":
+            if not 1 <= term[1] <= len(select_exprs):
+                raise ValueError(f"ORDER BY term out of range: {term[1]}")
+            term = select_exprs[term[1] - 1]
+        terms.append((term, descending))
+    names = [c.lower() if f == "identity" else None for (f, c), _ in terms]
+    ascending = not any(descending for _, descending in terms)
+
+    if is_aggregated(select_exprs, group_by):
+        # Groups come out ordered by their GROUP BY columns.
+        if ascending and names == [c.lower() for c in group_by[: len(names)]]:
+            return None, exprs, []
+    else:
+        # Rows come in rowid order however they are found, so a last term
+        # on the rowid only breaks ties, which a stable sort leaves in
+        # rowid order anyway.
+        rowid_names = get_rowid_names(table_name)
+        while terms and names[-1] in rowid_names and not terms[-1][1]:
+            terms.pop()
+            names.pop()
+        if not terms:
+            return None, exprs, []
+        if len(terms) == 1 and names[0] in rowid_names:
+            return "reverse", exprs, []
+        access, argument = plan_access(table_name, where_expr, JOBS)
+        if access == "index":
+            # Every row found has the same value in the indexed column.
+            _, index_rootpage = argument
+            if set(names) == {index_columns(table_name, index_rootpage)[0]}:
+                return None, exprs, []
+        elif access != "rowid range" and ascending:
+            for index_rootpage, columns in get_indexes(table_name):
+                if None not in names and columns[: len(names)] == names:
+                    return ("index", index_rootpage), exprs, []
+
+    sort_terms = []
+    for term, descending in terms:
+        if term not in exprs:
+            exprs.append(term)
+        sort_terms.append((exprs.index(term), descending))
+    return "sort", exprs, sort_terms
+
+
+def index_columns(table_name, index_rootpage):
+    (columns,) = [c for r, c in get_indexes(table_name) if r == index_rootpage]
+    return columns
+
+
+def select_rows(select_exprs, table_name, where_expr, group_by, order_by, limit):
+    """Return an iterator over the result rows of a parsed SELECT statement:
+    scan, filter, project, (aggregate, sort,) limit. Filtering and
+    projection are pushed down into the cell reader, so only the WHERE
+    columns are decoded for rows that do not match, and only the selected
+    columns for rows that do. Without a sort, LIMIT stops the walk of the
+    B-tree as soon as it has enough rows. With one, only the top rows are
+    kept in a heap, and without LIMIT large sorts spill to disk."""
+    order, exprs, sort_terms = plan_order(
+        table_name, where_expr, select_exprs, group_by, order_by
+    )
+    rows = project_rows(exprs, table_name, where_expr, group_by, order)
+    if order == "sort":
+        key = make_order_key(sort_terms)
+        if limit and limit[0] >= 0:
+            count, offset = limit
+            rows = top_k(rows, key, count + offset)
+        else:
+            rows = external_sort(rows, key)
+    if limit:
+        count, offset = limit
+        rows = itertools.islice(rows, offset, None if count < 0 else offset + count)
+    if len(exprs) > len(select_exprs):
+        # Drop the columns that were only there to be sorted by.
+        width = len(select_exprs)
+        rows = (row[:width] for row in rows)
+    return rows
+
+
+def project_rows(select_exprs, table_name, where_expr, group_by, order=None):
+    """Return an iterator over the rows of the select exprs, aggregated if
+    they call for it, in the order given by plan_order (if any)."""
+    if is_count_star(select_exprs, where_expr, group_by):
+        # Counting every row only needs the cell counts of the leaf pages.
+        return count_rows(get_rootpage_number(table_name))
+    if is_aggregated(select_exprs, group_by):
+        # Decode each column used by the select expressions or the GROUP BY
+        # once, and aggregate over rows of just those columns.
+        used = [c for _, c in select_exprs if c != "*"] + group_by
+        used = list(dict.fromkeys(used))
+        indices = [column_position(table_name, c) for c in used]
+        position = {c: p for p, c in enumerate(used)}
+        outputs = [(f, position.get(c)) for f, c in select_exprs]
+        rows = table_rows(table_name, where_expr, indices, JOBS)
+        return aggregate(rows, [position[c] for c in group_by], outputs)
+    # Collect the columns that appear in the select_statement.
+    indices = [column_position(table_name, e[1]) for e in select_exprs]
+    return table_rows(table_name, where_expr, indices, JOBS, order)
 
-    DATABASE_FILE_PATH = sys.argv[1]
-    COMMAND = sys.argv[2]
-    DATABASE_HEADER = read_database_header()
-    PAGESIZE = DATABASE_HEADER["page_size"]
-    assert DATABASE_HEADER["text_encoding"] == 1  # Assert we are UTF-8
-    SCHEMA_PAGE = page_bytes(1)
-    SCHEMA_PAGE_HEADER = read_page_header(SCHEMA_PAGE, True)
 
-    match COMMAND:
-        case ".dbinfo":
+# TODO: Handle select *
+def handle_select():
+    """Stream the rows of a table through a pipeline of generators, writing
+    them out in batches as soon as they are read, unless they have to be
+    aggregated or sorted first. Rows go to the sink for OUTPUT_FORMAT, at
+    OUTPUT_PATH or stdout. The time spent producing the rows and writing
+    them is measured per batch."""
+    with STATS.timer("parse"):
+        query = parse_query(COMMAND)
+    with STATS.timer("plan"):
+        rows = select_rows(*query)
+    names = [render_select_expr(e) for e in query[0]]
+    sink = open_sink(OUTPUT_FORMAT, OUTPUT_PATH, names)
+    clock = time.perf_counter
+    try:
+        while True:
+            start = clock()
+            batch = list(itertools.islice(rows, OUTPUT_BATCH_ROWS))
+            produced = clock()
+            STATS.timers["execute"] += produced - start
+            if not batch:
+                break
+            sink.write_batch(batch)
+            STATS.timers["emit"] += clock() - produced
+            STATS.rows_emitted += len(batch)
+    finally:
+        sink.close()
+
+
+def handle_explain():
+    """Print how a SELECT statement would be run, without running it."""
+    query = parse_query(COMMAND)
+    select_exprs, table_name, where_expr, group_by, order_by, limit = query
+    table = CATALOG.table(table_name)
+    print(f"table: {table['name']} (rootpage {table['rootpage']})")
+    order, exprs, sort_terms = plan_order(
+        table_name, where_expr, select_exprs, group_by, order_by
+    )
+    access, argument = plan_access(table_name, where_expr, JOBS)
+    if is_count_star(select_exprs, where_expr, group_by):
+        access = "count"
+    elif isinstance(order, tuple):
+        access, argument = "index order", order[1]
+    elif order == "reverse" and access in ("scan", "parallel scan"):
+        access = "reverse scan"
+    match access:
+        case "count":
+            print("access: count the cells of the leaf pages")
+        case "index order":
+            print(
+                f"access: every entry of index {index_name(table_name, argument)}"
+                f" (rootpage {argument}), in order"
+            )
+        case "reverse scan":
+            print("access: full scan, backwards")
+        case "rowid range":
+            lo, hi = argument
+            backwards = ", backwards" if order == "reverse" else ""
+            print(f"access: rowid range {lo} to {hi}{backwards}")
+        case "index":
+            value, index_rootpage = argument
+            backwards = ", backwards" if order == "reverse" else ""
+            print(
+                f"access: index {index_name(table_name, index_rootpage)}"
+                f" (rootpage {index_rootpage}),"
+                f" {index_columns(table_name, index_rootpage)[0]} = {value!r}"
+                f"{backwards}"
+            )
+        case "parallel scan":
+            print(f"access: full scan with {argument} worker processes")
+        case "scan":
+            print("access: full scan")
+    if where_expr:
+        where_columns = list(dict.fromkeys(expression_columns(where_expr)))
+        print(f"filter: on {', '.join(where_columns)}")
+    if access == "count":
+        return
+    columns = [c for _, c in exprs if c != "*"] + group_by
+    print(f"decode: {', '.join(dict.fromkeys(columns))}")
+    if is_aggregated(select_exprs, group_by):
+        outputs = ", ".join(map(render_select_expr, select_exprs))
+        grouping = f" group by {', '.join(group_by)}" if group_by else ""
+        print(f"aggregate: {outputs}{grouping}")
+    if order == "sort":
+        terms = ", ".join(
+            render_select_expr(exprs[i]) + (" desc" if descending else "")
+            for i, descending in sort_terms
+        )
+        if limit and limit[0] >= 0:
+            print(f"sort: {terms}, keeping the first {sum(limit)} rows in a heap")
+        else:
+            print(
+                f"sort: {terms}, in memory up to {SORT_RUN_ROWS} rows,"
+                " otherwise in runs spilled to disk"
+            )
+    if limit:
+        count, offset = limit
+        print(f"limit: {'all' if count < 0 else count} rows from row {offset}")
+
+
+def render_select_expr(select_expr):
+    function_name, column = select_expr
+    return column if function_name == "identity" else f"{function_name}({column})"
+
+
+def index_name(table_name, index_rootpage):
+    for index in CATALOG.table_indexes(table_name):
+        if index["rootpage"] == index_rootpage:
+            return index["name"]
+
+
+def handle_stats():
+    """Run the command, then print what it cost to stderr, leaving its
+    output alone."""
+    dispatch(COMMAND)
+    for line in format_stats(STATS.as_dict(PAGER)):
+        print(line, file=sys.stderr)
+
+
+def dispatch(command):
+    """Run a command from the command line: a dot command, a SELECT
+    statement, or either of those prefixed with .stats, or a SELECT
+    statement prefixed with EXPLAIN."""
+    global COMMAND
+    COMMAND = command
+    match command.split(maxsplit=1):
+        case [".dbinfo"]:
             handle_dbinfo()
-        case ".tables":
+        case [".tables"]:
             handle_tables()
-        # Specialised select for this type of query.
-        # Delete in favour of fewer specialisations or keep?
-        case str() if COMMAND.lower().startswith("select count(*) from"):
-            tbl_name = COMMAND.split(" ")[-1]
-            handle_count(tbl_name)
-        case str() if COMMAND.lower().startswith("select"):
+        case [word, _] if word.lower() == "select":
             handle_select()
+        case [word, statement] if word.lower() == "explain":
+            COMMAND = statement
+            handle_explain()
+        case [".stats", statement]:
+            COMMAND = statement
+            handle_stats()
         case _:
-            print(f"Invalid command: {COMMAND}")
+            print(f"Invalid command: {command}")
+
+
+# END
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="app.main")
+    parser.add_argument("database")
+    parser.add_argument("command", nargs="?")
+    parser.add_argument(
+        "--catalog-cache",
+        metavar="PATH",
+        help="cache the parsed schema in this file, to be reused by later runs",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        metavar="N",
+        help="scan tables with N worker processes (default: 1)",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="keep the database open and run the commands read from stdin,"
+        " or from the socket given by --socket, one per line",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="with --serve, listen on a Unix socket at PATH instead of stdin",
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="pipe",
+        help="how to write the rows of a SELECT (default: pipe)",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="PATH",
+        help="write the rows of a SELECT to this file (a directory for npy)"
+        " instead of stdout",
+    )
+    ARGS = parser.parse_args()
+    if ARGS.serve == (ARGS.command is not None):
+        parser.error("give either a command or --serve")
+    if ARGS.format == "npy" and not ARGS.output:
+        parser.error("the npy format needs --output DIRECTORY")
+    if ARGS.serve:
+        if ARGS.output:
+            parser.error("--output can't be used with --serve")
+        from .server import serve
+
+        serve(ARGS.database, ARGS.socket, ARGS.catalog_cache, ARGS.jobs, ARGS.format)
+        sys.exit()
+
+    JOBS = ARGS.jobs
+    OUTPUT_FORMAT = ARGS.format
+    OUTPUT_PATH = ARGS.output
+    with STATS.timer("open"):
+        open_database(ARGS.database)
+    with STATS.timer("catalog"):
+        CATALOG = load_catalog(ARGS.catalog_cache)
+    # Count only what the command itself does, not reading the schema.
+    STATS.reset_counters()
+    PAGER.hits = PAGER.misses = 0
+
+    dispatch(ARGS.command)
@@ -0,0 +1,308 @@
+import array
+import base64
+import json
+import os
+import re
+import struct
+import sys
+
+from .overflow import OverflowValue, materialize
+
+# Rows formatted and written together. Each batch is one write to the sink.
+OUTPUT_BATCH_ROWS = 4096
+
+OUTPUT_FORMATS = ("pipe", "csv", "ndjson", "npy")
+
+
+def open_sink(output_format, path, names):
+    """Return a sink writing rows in the given format to the file at path, or
+    to stdout if path is None. names are the column names. The npy format
+    writes a directory of files, so it needs a path."""
+    if output_format == "npy":
+        if path is None:
+            raise ValueError("The npy format writes a directory, give it a path")
+        return NpySink(path, names)
+    if path is None:
+        stream, owned = sys.stdout, False
+    else:
+        stream, owned = open(path, "w", encoding="utf-8", newline=""), True
+    return TEXT_SINKS[output_format](stream, names, owned)
+
+
+def unique_names(names):
+    """Make column names unique, by appending _2, _3, ... to repeats."""
+    seen, out = {}, []
+    for name in names:
+        n = seen[name] = seen.get(name, 0) + 1
+        out.append(name if n == 1 else f"{name}_{n}")
+    return out
+
+
+# -- Text formats.
+#    Each batch of rows is formatted into one string and written at once.
+
+
+class TextSink:
+    def __init__(self, stream, names, owned=False):
+        self.stream = stream
+        self.names = names
+        self.owned = owned
+
+    def write_batch(self, rows):
+        self.stream.write("".join(map(self.format_row, rows)))
+
+    def close(self):
+        if self.owned:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class PipeSink(TextSink):
+    """The original format: values separated by |, NULL as "NULL". TEXT values
+    stored on overflow pages are written a page at a time rather than
+    assembled first."""
+
+    def write_batch(self, rows):
+        out = []
+        for row in rows:
+            if OverflowValue not in map(type, row):
+                out.append("|".join(["NULL" if v is None else str(v) for v in row]))
+                out.append("\n")
+                continue
+            for i, value in enumerate(row):
+                if i:
+                    out.append("|")
+                if type(value) is OverflowValue and value.is_text:
+                    self.stream.write("".join(out))
+                    out = []
+                    for chunk in value.chunks():
+                        self.stream.write(chunk)
+                else:
+                    out.append("NULL" if value is None else str(value))
+            out.append("\n")
+        self.stream.write("".join(out))
+
+
+def csv_value(value):
+    """Format a value for CSV. TEXT is always quoted, so that NULL (an empty
+    field) and the empty string ("") can be told apart. BLOBs are written
+    unquoted as "base64:" and their base64 text, so an empty BLOB is neither
+    of those."""
+    if value is None:
+        return ""
+    if type(value) is OverflowValue:
+        value = value.materialize()
+    if type(value) is str:
+        return '"' + value.replace('"', '""') + '"'
+    if type(value) is bytes:
+        return "base64:" + base64.b64encode(value).decode("ascii")
+    return str(value)
+
+
+class CsvSink(TextSink):
+    """RFC 4180 CSV with a header row and CRLF line endings."""
+
+    def __init__(self, stream, names, owned=False):
+        super().__init__(stream, names, owned)
+        self.stream.write(",".join(map(csv_value, names)) + "\r\n")
+
+    def format_row(self, row):
+        return ",".join(map(csv_value, row)) + "\r\n"
+
+
+def json_value(value):
+    """Convert a value for JSON. BLOBs become {"base64": ...} objects, so they
+    can't be taken for TEXT."""
+    if type(value) is OverflowValue:
+        value = value.materialize()
+    if type(value) is bytes:
+        return {"base64": base64.b64encode(value).decode("ascii")}
+    return value
+
+
+class NdjsonSink(TextSink):
+    """One JSON object per line, keyed by column name. NULL is null, and
+    BLOBs are {"base64": ...} objects."""
+
+    def __init__(self, stream, names, owned=False):
+        super().__init__(stream, names, owned)
+        self.keys = unique_names(names)
+        self.encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def format_row(self, row):
+        return self.encode(dict(zip(self.keys, map(json_value, row)))) + "\n"
+
+
+TEXT_SINKS = {"pipe": PipeSink, "csv": CsvSink, "ndjson": NdjsonSink}
+
+
+# END
+
+
+# -- Columnar binary format.
+#    Refer to https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html
+#    Each column becomes NAME.npy in the output directory, a 1-d array of
+#      int64    for INTEGER columns,
+#      float64  for REAL columns (and columns mixing INTEGER and REAL),
+#      uint8    for TEXT (UTF-8) and BLOB columns, holding the values one
+#               after the other. NAME.offsets.npy (int64) then has one more
+#               entry than there are rows, and value i is the slice
+#               offsets[i]:offsets[i + 1].
+#    If a column has NULLs, NAME.nulls.npy is a bool array that is True
+#    where the value is NULL (and the value itself is 0, NaN or empty). A
+#    column of only NULLs is written as int64. A column that mixes numbers
+#    with TEXT or BLOBs, or TEXT with BLOBs, can't be written.
+#    The arrays are written batch by batch with the array module, so numpy
+#    is not needed, and the length in the header is filled in at the end.
+
+
+# The header, with the length of the array, is padded to a fixed size so
+# that it can be rewritten once the length is known.
+NPY_HEADER_BYTES = 128
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+# array module typecodes, by .npy dtype.
+NPY_TYPECODES = {"<i8": "q", "<f8": "d", "|u1": "B", "|b1": "B"}
+
+
+class NpyArray:
+    """A 1-d .npy file of a fixed dtype, written a batch at a time."""
+
+    def __init__(self, path, descr):
+        self.file = open(path, "w+b")
+        self.descr = descr
+        self.length = 0
+        self.write_header()
+
+    def write_header(self):
+        header = (
+            f"{{'descr': '{self.descr}', 'fortran_order': False,"
+            f" 'shape': ({self.length},), }}"
+        )
+        header = header.ljust(NPY_HEADER_BYTES - len(NPY_MAGIC) - 3) + "\n"
+        self.file.write(NPY_MAGIC + struct.pack("<H", len(header)))
+        self.file.write(header.encode("latin1"))
+
+    def append(self, values):
+        data = array.array(NPY_TYPECODES[self.descr], values)
+        if sys.byteorder == "big":
+            data.byteswap()
+        data.tofile(self.file)
+        self.length += len(data)
+
+    def retype(self, descr):
+        """Convert the values written so far to another dtype."""
+        self.file.seek(NPY_HEADER_BYTES)
+        data = array.array(NPY_TYPECODES[self.descr])
+        data.frombytes(self.file.read())
+        if sys.byteorder == "big":
+            data.byteswap()
+        self.file.seek(NPY_HEADER_BYTES)
+        self.file.truncate()
+        self.descr, self.length = descr, 0
+        self.append(data)
+
+    def close(self):
+        self.file.seek(0)
+        self.write_header()
+        self.file.close()
+
+
+class NpyColumn:
+    """One column of the output, as one or more .npy files."""
+
+    def __init__(self, path):
+        self.path = path
+        self.kind = None
+        self.length = 0
+        self.data = self.offsets = self.nulls = None
+        self.end = 0  # The end of the TEXT/BLOB data written so far.
+
+    def start(self, kind):
+        """Create the files, once the first non-NULL value shows the kind of
+        the column, and account for the NULLs before it."""
+        self.kind = kind
+        descr = {int: "<i8", float: "<f8", str: "|u1", bytes: "|u1"}[kind]
+        self.data = NpyArray(f"{self.path}.npy", descr)
+        if kind in (str, bytes):
+            self.offsets = NpyArray(f"{self.path}.offsets.npy", "<i8")
+            self.offsets.append([0] * (self.length + 1))
+        else:
+            self.data.append([0] * self.length)
+
+    def write(self, values):
+        values = [materialize(v) for v in values]
+        null_mask = [v is None for v in values]
+        if self.nulls is None and any(null_mask):
+            self.nulls = NpyArray(f"{self.path}.nulls.npy", "|b1")
+            self.nulls.append(
+                [1] * self.length if self.kind is None else [0] * self.length
+            )
+        if self.kind is None:
+            kinds = [type(v) for v in values if v is not None]
+            if kinds:
+                self.start(kinds[0])
+        if self.kind is not None:
+            self.write_values(values)
+        if self.nulls is not None:
+            self.nulls.append(null_mask)
+        self.length += len(values)
+
+    def write_values(self, values):
+        kinds = {type(v) for v in values} - {type(None)}
+        if self.kind is int and float in kinds:
+            self.data.retype("<f8")
+            self.kind = float
+        allowed = {int, float} if self.kind in (int, float) else {self.kind}
+        if not kinds <= allowed:
+            raise ValueError(
+                f"Column {os.path.basename(self.path)} mixes"
+                f" {', '.join(sorted(t.__name__ for t in kinds | {self.kind}))}"
+                " values, which can't be written as one array"
+            )
+        if self.kind is int:
+            self.data.append([0 if v is None else v for v in values])
+        elif self.kind is float:
+            nan = float("nan")
+            self.data.append([nan if v is None else v for v in values])
+        else:
+            if self.kind is str:
+                values = [b"" if v is None else v.encode("utf-8") for v in values]
+            else:
+                values = [b"" if v is None else v for v in values]
+            offsets = []
+            for value in values:
+                self.end += len(value)
+                offsets.append(self.end)
+            self.data.append(b"".join(values))
+            self.offsets.append(offsets)
+
+    def close(self):
+        if self.kind is None:
+            # Only NULLs (or no rows at all).
+            self.start(int)
+        for f in (self.data, self.offsets, self.nulls):
+            if f is not None:
+                f.close()
+
+
+class NpySink:
+    """Write each column to .npy files in a directory, see above."""
+
+    def __init__(self, directory, names):
+        os.makedirs(directory, exist_ok=True)
+        # Column names like count(*) are made safe to use as file names.
+        names = unique_names([re.sub(r"[^\w.-]", "_", name) for name in names])
+        self.columns = [NpyColumn(os.path.join(directory, name)) for name in names]
+
+    def write_batch(self, rows):
+        for i, column in enumerate(self.columns):
+            column.write([row[i] for row in rows])
+
+    def close(self):
+        for column in self.columns:
+            column.close()
+
+
+# END
@@ -0,0 +1,143 @@
+import codecs
+
+from .serial_types import read_serial, serial_type_size
+from .stats import STATS
+
+# -- Overflow pages.
+#    Refer to '1.6. B-tree Pages' of https://www.sqlite.org/fileformat.html
+#    A payload too big to fit in its cell keeps a prefix on the page, and
+#    the rest spills onto a linked list of overflow pages. Each overflow page
+#    starts with the 4 byte number of the next one (0 for the last), followed
+#    by usable size - 4 bytes of payload.
+
+
+def local_payload_size(payload_size, usable_size, table_leaf):
+    """Return how many bytes of a payload are stored on the B-tree page.
+    The rest, if any, spills onto overflow pages."""
+    if table_leaf:
+        max_local = usable_size - 35
+    else:
+        max_local = ((usable_size - 12) * 64 // 255) - 23
+    if payload_size <= max_local:
+        return payload_size
+    min_local = ((usable_size - 12) * 32 // 255) - 23
+    local = min_local + (payload_size - min_local) % (usable_size - 4)
+    return local if local <= max_local else min_local
+
+
+class Payload:
+    """
+    A cell payload that spills onto overflow pages.
+
+    The overflow chain is followed lazily: reading a range of the payload
+    only reads the overflow pages up to the end of that range, and the page
+    numbers found on the way are remembered for later reads.
+    """
+
+    def __init__(self, pager, page, start, size, local_size, usable_size):
+        self.pager = pager
+        self.page = page
+        self.start = start
+        self.size = size
+        self.local_size = local_size
+        self.content_size = usable_size - 4
+        first = int.from_bytes(page[start + local_size : start + local_size + 4])
+        self.overflow_pages = [first]
+
+    def overflow_page(self, k):
+        """Return the number of the k-th (from 0) overflow page."""
+        while len(self.overflow_pages) <= k:
+            STATS.overflow_pages_followed += 1
+            page = self.pager.page(self.overflow_pages[-1])
+            self.overflow_pages.append(int.from_bytes(page[:4]))
+        return self.overflow_pages[k]
+
+    def chunks(self, offset, n_bytes):
+        """Yield memoryviews covering n_bytes of the payload from offset,
+        one per page touched."""
+        end = offset + n_bytes
+        if offset < self.local_size:
+            yield self.page[
+                self.start + offset : self.start + min(end, self.local_size)
+            ]
+            offset = self.local_size
+        while offset < end:
+            k, page_offset = divmod(offset - self.local_size, self.content_size)
+            page = self.pager.page(self.overflow_page(k))
+            STATS.overflow_pages_read += 1
+            n = min(end - offset, self.content_size - page_offset)
+            yield page[4 + page_offset : 4 + page_offset + n]
+            offset += n
+
+    def read(self, offset, n_bytes):
+        """Return n_bytes of the payload from offset. This is a view of the
+        page when the range is stored locally, and a copy otherwise."""
+        if offset + n_bytes <= self.local_size:
+            return self.page[self.start + offset : self.start + offset + n_bytes]
+        return b"".join(self.chunks(offset, n_bytes))
+
+
+class OverflowValue:
+    """
+    A TEXT or BLOB value that spills onto overflow pages. No overflow page
+    is read until the value is used: chunks() streams it a page at a time,
+    and materialize() (or str()) assembles the whole value.
+    """
+
+    def __init__(self, payload, offset, serial_type):
+        self.payload = payload
+        self.offset = offset
+        self.serial_type = serial_type
+        self.size = (serial_type - 12) >> 1
+        self.is_text = bool(serial_type & 1)
+
+    def chunks(self):
+        """Yield the value in pieces: str for TEXT, bytes for BLOB."""
+        pieces = self.payload.chunks(self.offset, self.size)
+        if not self.is_text:
+            yield from map(bytes, pieces)
+            return
+        # A UTF-8 character may be split between two pages.
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for piece in pieces:
+            yield decoder.decode(piece)
+        yield decoder.decode(b"", final=True)
+
+    def materialize(self):
+        return read_serial(
+            self.serial_type, self.payload.read(self.offset, self.size), 0
+        )
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return str(self.materialize())
+
+    def __reduce__(self):
+        # Sent to another process (say, from a parallel scan worker) as the
+        # plain value, since the pager can't go with it.
+        value = self.materialize()
+        return (type(value), (value,))
+
+
+def read_payload_column(payload, n, offset, lazy=False):
+    """Decode the column of serial type n at offset in a spilled payload.
+    With lazy set, a TEXT or BLOB that is not stored locally is returned
+    as an OverflowValue, without reading any overflow pages yet."""
+    size = serial_type_size(n)
+    if offset + size <= payload.local_size:
+        return read_serial(n, payload.page, payload.start + offset)
+    if lazy and n >= 12:
+        return OverflowValue(payload, offset, n)
+    return read_serial(n, payload.read(offset, size), 0)
+
+
+def materialize(value):
+    """Return the plain value of a column, assembling it if it spilled."""
+    if type(value) is OverflowValue:
+        return value.materialize()
+    return value
+
+
+# END
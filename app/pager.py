@@ -0,0 +1,90 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+# Number of pages kept in the LRU cache by default.
+DEFAULT_CACHE_PAGES = 2048
+
+
+class Pager:
+    """
+    Serve the pages of a database file, which is opened exactly once.
+
+    When the file can be mapped, pages are zero-copy memoryviews over the
+    mmap. Otherwise (empty files, platforms/filesystems without mmap) pages
+    are read with pread and wrapped in a memoryview, so callers always get
+    the same kind of object back. Either way recently used pages are kept
+    in a size-bounded LRU cache, which is locked so that threads can share
+    the pager.
+    """
+
+    def __init__(self, path, cache_pages=DEFAULT_CACHE_PAGES):
+        self.path = path
+        self.file = open(path, "rb")
+        self.fd = self.file.fileno()
+        try:
+            self.mmap = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            self.buffer = memoryview(self.mmap)
+        except (ValueError, OSError):
+            self.mmap = None
+            self.buffer = None
+        self.page_size = page_size_from_header(self.read(16, 2))
+        self.cache = OrderedDict()
+        self.cache_pages = cache_pages
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, offset, n_bytes):
+        """Read n_bytes from an absolute offset in the file."""
+        if self.buffer is not None:
+            return self.buffer[offset : offset + n_bytes]
+        return self.read_from_file(offset, n_bytes)
+
+    def read_from_file(self, offset, n_bytes):
+        """Read n_bytes from an absolute offset, bypassing the map. This sees
+        changes made to the file after it was mapped, even past its old end."""
+        if hasattr(os, "pread"):
+            return memoryview(os.pread(self.fd, n_bytes, offset))
+        self.file.seek(offset)
+        return memoryview(self.file.read(n_bytes))
+
+    def page(self, page_number):
+        """Return the page. Note that they start counting at 1."""
+        with self.lock:
+            try:
+                page = self.cache[page_number]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.cache.move_to_end(page_number)
+                return page
+            page = self.read(self.page_size * (page_number - 1), self.page_size)
+            self.cache[page_number] = page
+            if len(self.cache) > self.cache_pages:
+                self.cache.popitem(last=False)
+            return page
+
+    def close(self):
+        self.cache.clear()
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # A caller still holds a view of a page; the map is
+                # released when that view is garbage collected.
+                pass
+            self.mmap = None
+        self.file.close()
+
+
+def page_size_from_header(data):
+    """Decode the two byte page size at offset 16 of the database header.
+    The value 1 is used to represent a page size of 65536."""
+    page_size = int.from_bytes(data)
+    return 65536 if page_size == 1 else page_size
@@ -1,62 +1,121 @@
-import sqlparse
-import sqlparse.tokens as T
+from .aggregate import is_aggregate
+from .expressions import Parser, tokenize
 
-"where age > 18"
 
+def parse_select_expr(parser):
+    """Parse something like "min(age)" or "surname" into a (function name,
+    column name) tuple. Plain columns get the function name "identity".
+    The only functions are the aggregates, and only COUNT takes *."""
+    kind, name = parser.next()
+    if kind != "identifier":
+        raise ValueError(f"Expected a column name, got {name!r}")
+    if parser.accept("operator", "("):
+        function_name = name.lower()
+        if not is_aggregate(function_name):
+            raise ValueError(f"No such function: {name}")
+        kind, column = parser.next()
+        if (kind, column) == ("operator", "*"):
+            if function_name != "count":
+                raise ValueError(f"Wrong number of arguments to function {name}()")
+        elif kind != "identifier":
+            raise ValueError(f"Expected a column name or *, got {column!r}")
+        parser.expect("operator", ")")
+        return (function_name, column)
+    return ("identity", name)
 
-def make_predicate(where_condition):
-    cond = where_condition.split()
-    assert cond[0].lower() == "where"
-    cond.pop(0)
-    column_name = cond.pop(0)
-    operator = cond.pop(0)
-    right = " ".join(cond)[1:-1]
-    if operator == "=":
-        operator = "=="
 
-    def p(left):
-        return eval(f"'{left}' {operator} '{right}'")
-
-    return (column_name, p)
-
-
-def parse_select_exprs(exprs):
+def parse_select_exprs(parser):
     """
     Helper function for the parser below, to parse something
-    like "min(age), surname" into a list of (callable, column name) tuples.
-    This is future-proofing, since calls like min(age) are not required at
-    the moment.
+    like "min(age), surname" into a list of (function name, column name) tuples.
     """
-    identity = lambda x: x
-    out = []
-    for e in exprs.value.split():
-        # This feels ugly
-        e = e.replace(",", "")
-        if "(" in e:
-            e = e.split("(")
-            e[1] = e[1][:-1]  # Drop closing parenth.
-        else:
-            e = ("identity", e)
-        out.append(tuple(e))
+    out = [parse_select_expr(parser)]
+    while parser.accept("operator", ","):
+        out.append(parse_select_expr(parser))
     return out
 
 
+def parse_column_names(parser):
+    """Parse a comma separated list of column names."""
+    names = []
+    while True:
+        kind, name = parser.next()
+        if kind != "identifier":
+            raise ValueError(f"Expected a column name, got {name!r}")
+        names.append(name)
+        if not parser.accept("operator", ","):
+            return names
+
+
+def parse_order_by(parser):
+    """Parse something like "surname, count(*) DESC, 2" into a list of
+    (term, descending) pairs. Terms are select expressions as above, or
+    ("position", n) for the n-th (from 1) select expression."""
+    terms = []
+    while True:
+        kind, value = parser.peek()
+        if kind == "number":
+            parser.next()
+            if not isinstance(value, int):
+                raise ValueError(f"Expected a column number, got {value!r}")
+            term = ("position", value)
+        else:
+            term = parse_select_expr(parser)
+        descending = parser.accept("keyword", "desc")
+        if not descending:
+            parser.accept("keyword", "asc")
+        terms.append((term, descending))
+        if not parser.accept("operator", ","):
+            return terms
+
+
+def parse_integer(parser):
+    negative = parser.accept("operator", "-")
+    kind, value = parser.next()
+    if kind != "number" or not isinstance(value, int):
+        raise ValueError(f"Expected an integer, got {value!r}")
+    return -value if negative else value
+
+
+def parse_limit(parser):
+    """Parse "count [OFFSET offset]" or "offset, count" into (count,
+    offset). A negative count means no limit, as in SQLite."""
+    count = parse_integer(parser)
+    offset = 0
+    if parser.accept("keyword", "offset"):
+        offset = parse_integer(parser)
+    elif parser.accept("operator", ","):
+        count, offset = parse_integer(parser), count
+    return (count, max(offset, 0))
+
+
 def parse_select(sql):
-    sql = sqlparse.parse(sql)[0]
-    # Parse the 'SELECT' keyword.
-    assert sql[0].ttype == T.Keyword.DML and sql[0].value.lower() == "select"
-    assert sql[1].ttype == T.Whitespace
-    select_exprs = sql[2]
-    # This is now a list of (function name or None, column name).
-    select_exprs = parse_select_exprs(select_exprs)
-    assert sql[3].ttype == T.Whitespace
-    assert sql[4].ttype == T.Keyword and sql[4].value.lower() == "from"
-    assert sql[5].ttype == T.Whitespace
-    # Parse table name.
-    table_name = sql[6].value
-    if len(sql.tokens) > 7:
-        assert sql[7].ttype == T.Whitespace
-        condition = sql[8].value
-    else:
-        condition = None
-    return (select_exprs, table_name, condition)
+    """Parse "SELECT exprs FROM table [WHERE condition] [GROUP BY columns]
+    [ORDER BY terms] [LIMIT count [OFFSET offset]]" into (select exprs,
+    table name, parsed condition or None, group by column names, order by
+    terms, (count, offset) or None)."""
+    parser = Parser(tokenize(sql))
+    parser.expect("keyword", "select")
+    # This is now a list of (function name or "identity", column name).
+    select_exprs = parse_select_exprs(parser)
+    parser.expect("keyword", "from")
+    kind, table_name = parser.next()
+    if kind != "identifier":
+        raise ValueError(f"Expected a table name, got {table_name!r}")
+    condition = None
+    if parser.accept("keyword", "where"):
+        condition = parser.parse_or()
+    group_by = []
+    if parser.accept("keyword", "group"):
+        parser.expect("keyword", "by")
+        group_by = parse_column_names(parser)
+    order_by = []
+    if parser.accept("keyword", "order"):
+        parser.expect("keyword", "by")
+        order_by = parse_order_by(parser)
+    limit = None
+    if parser.accept("keyword", "limit"):
+        limit = parse_limit(parser)
+    parser.accept("operator", ";")
+    parser.expect_end()
+    return (select_exprs, table_name, condition, group_by, order_by, limit)
@@ -1,32 +1,59 @@
-def serial_type_from_int(n):
-    """Return a tuple of (serial type, n_bytes) as described in '2.1. Record Format'"""
-    match n:
-        case 0:
-            return ("NULL", 0)
-        case 1 | 2 | 3 | 4 | 5 | 6:
-            return ("int", n)
-        case 7:
-            return ("float", 8)
-        case 8:
-            return ("int", 0)
-        case 9:
-            return ("int", 1)
-        case n if n >= 12 and n % 2 == 0:
-            return ("blob", (n - 12) // 2)
-        case n if n >= 13 and n % 2 == 1:
-            return ("string", (n - 13) // 2)
-        case _:
-            raise ValueError(f"Unknown serial type specifier: {n}")
-
-
-def read_serial(serial_type, data):
-    """Decode data given the serial type and some bytes."""
-    match serial_type:
-        case ("NULL", 0):
-            return "NULL"
-        case ("string", n):
-            return data[:n].decode("utf-8")
-        case ("int", n):
-            return int.from_bytes(data[:n], byteorder="big", signed=False)
-        case _:
-            raise ValueError(f"Unknown serial type: {serial_type}")
+import struct
+
+# Refer to '2.1. Record Format' for the serial types.
+# Serial types 10 and 11 are reserved for internal use.
+
+# The number of bytes of content for each serial type below 12.
+SERIAL_TYPE_SIZES = (0, 1, 2, 3, 4, 6, 8, 8, 0, 0)
+
+
+def _read_int24(data, offset):
+    return int.from_bytes(data[offset : offset + 3], signed=True)
+
+
+def _read_int48(data, offset):
+    return int.from_bytes(data[offset : offset + 6], signed=True)
+
+
+def _unpacker(fmt):
+    unpack_from = struct.Struct(fmt).unpack_from
+    return lambda data, offset: unpack_from(data, offset)[0]
+
+
+# Decoders for each serial type below 12, indexed by serial type.
+# Integers are big-endian twos-complement, floats are big-endian IEEE 754.
+SERIAL_TYPE_DECODERS = (
+    lambda data, offset: None,
+    _unpacker(">b"),
+    _unpacker(">h"),
+    _read_int24,
+    _unpacker(">i"),
+    _read_int48,
+    _unpacker(">q"),
+    _unpacker(">d"),
+    lambda data, offset: 0,
+    lambda data, offset: 1,
+)
+
+
+def serial_type_size(n):
+    """Return the number of bytes of content for serial type n."""
+    if n < 10:
+        return SERIAL_TYPE_SIZES[n]
+    if n < 12:
+        raise ValueError(f"Unknown serial type specifier: {n}")
+    # (n - 12) / 2 for BLOBs (even n) and (n - 13) / 2 for TEXT (odd n).
+    return (n - 12) >> 1
+
+
+def read_serial(n, data, offset):
+    """Decode the value of serial type n starting at offset in data.
+    NULL is decoded as None, TEXT as str and BLOB as bytes."""
+    if n < 10:
+        return SERIAL_TYPE_DECODERS[n](data, offset)
+    if n < 12:
+        raise ValueError(f"Unknown serial type specifier: {n}")
+    end = offset + ((n - 12) >> 1)
+    if n & 1:
+        return str(data[offset:end], "utf-8")
+    return bytes(data[offset:end])
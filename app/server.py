@@ -0,0 +1,243 @@
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+from contextlib import redirect_stderr, redirect_stdout
+
+from . import main
+from .output import TEXT_SINKS
+
+# -- Server mode.
+#    Keep databases open between queries, read from stdin or a Unix socket,
+#    one command per line. The output of each command is sent back followed
+#    by a line holding just ".", or ".error: message" if it failed. Output
+#    lines that start with "." get another "." in front, as in SMTP, so the
+#    end of a response is unambiguous. A ".open PATH" command switches the
+#    connection to another database, which is then kept open too.
+#
+#    The query engine in main.py keeps the open database in module globals,
+#    so requests take turns: each one installs its database's state, runs
+#    into a buffer and then lets the next one in, before sending the buffer
+#    to its client. A client that is slow to read its results (or doesn't)
+#    only holds up itself. Connections are served by threads, which wait for
+#    their turn while idle clients hold nothing.
+
+# The module globals of main.py that belong to an open database.
+DATABASE_STATE = (
+    "DATABASE_FILE_PATH",
+    "PAGER",
+    "DATABASE_HEADER",
+    "PAGESIZE",
+    "USABLE_SIZE",
+    "CATALOG",
+    "STATEMENTS",
+)
+
+# Bytes of a response buffered in memory. Larger responses are spilled to a
+# temporary file until they are sent.
+RESPONSE_MEMORY_BYTES = 4 << 20
+
+# Offset of the file change counter in the database header. Writers bump it
+# whenever they commit, at least in rollback journal mode. In WAL mode it
+# is not updated, and changes in the WAL file are not seen anyway.
+FILE_CHANGE_COUNTER_OFFSET = 24
+
+
+class Database:
+    """
+    An open database: the pager, header, catalog and statement cache that
+    main.open_database and main.load_catalog set up, saved so that they can
+    be installed again for the next request on this database.
+    """
+
+    def __init__(self, path, catalog_cache=None):
+        self.path = path
+        self.catalog_cache = catalog_cache
+        self.state = None
+        self.version = None
+        self.open()
+
+    def open(self):
+        """(Re)open the database. The statements parsed before are kept if
+        the catalog read now is the same as before. The schema cookie can't
+        tell, since the file may have been replaced by another database,
+        which is likely to have the same small cookie."""
+        old_state = self.state
+        main.open_database(self.path)
+        main.CATALOG = main.load_catalog(self.catalog_cache)
+        if old_state and same_catalog(old_state["CATALOG"], main.CATALOG):
+            main.STATEMENTS = old_state["STATEMENTS"]
+        if old_state:
+            old_state["PAGER"].close()
+        self.state = {name: getattr(main, name) for name in DATABASE_STATE}
+        self.version = self.read_version()
+
+    def read_version(self):
+        """Return what identifies the current contents of the file: which
+        file it is (it may have been replaced), its size and modification
+        time (another database may have been copied over it) and its change
+        counter."""
+        stat = os.stat(self.path)
+        pager = self.state["PAGER"]
+        counter = pager.read_from_file(FILE_CHANGE_COUNTER_OFFSET, 4)
+        return (
+            stat.st_dev,
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+            int.from_bytes(counter),
+        )
+
+    def install(self):
+        """Install this database in main's globals, reopening it first if
+        the file has changed since it was opened, which drops the cached
+        pages (and the catalog and statements, if the schema changed)."""
+        for name, value in self.state.items():
+            setattr(main, name, value)
+        try:
+            changed = self.read_version() != self.version
+        except FileNotFoundError:
+            raise ValueError(f"Database was removed: {self.path}") from None
+        if changed:
+            self.open()
+
+
+def same_catalog(a, b):
+    return (a.tables, a.indexes) == (b.tables, b.indexes)
+
+
+class ResponseWriter:
+    """Write the output of a command to a text stream, putting an extra "."
+    in front of lines that start with "." (see above)."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.at_line_start = True
+
+    def write(self, text):
+        if not text:
+            return 0
+        if self.at_line_start and text[0] == ".":
+            self.stream.write(".")
+        self.stream.write(text.replace("\n.", "\n.."))
+        self.at_line_start = text[-1] == "\n"
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def end(self, error=None):
+        """End the response, successfully unless error is given."""
+        if not self.at_line_start:
+            self.stream.write("\n")
+        self.stream.write("." if error is None else f".error: {error}")
+        self.stream.write("\n")
+        self.stream.flush()
+        self.at_line_start = True
+
+
+class Server:
+    """The databases kept open, and the lock that requests take turns on."""
+
+    def __init__(self):
+        self.databases = {}
+        self.lock = threading.Lock()
+
+    def database(self, path, catalog_cache=None):
+        """Return the open database at path, opening it the first time.
+        Must be called with the lock held."""
+        key = os.path.realpath(path)
+        if key not in self.databases:
+            try:
+                self.databases[key] = Database(path, catalog_cache)
+            except OSError as e:
+                raise ValueError(f"Cannot open {path}: {e.strerror}") from None
+        return self.databases[key]
+
+    def serve_stream(self, path, lines, stream):
+        """Answer the commands read from lines, starting on the database at
+        path, writing the responses to the text stream."""
+        writer = ResponseWriter(stream)
+        for line in lines:
+            command = line.strip()
+            if not command:
+                continue
+            try:
+                match command.split(maxsplit=1):
+                    case [".open", new_path]:
+                        with self.lock:
+                            self.database(new_path)
+                        path = new_path
+                    case _:
+                        self.run(path, command, writer)
+            except Exception as e:
+                # A bad query must not take the server down with it.
+                writer.end(error=str(e) or type(e).__name__)
+            else:
+                writer.end()
+
+    def run(self, path, command, writer):
+        """Run a command with the lock held, buffering its output, and send
+        the output (even of a command that failed) once the lock is free."""
+        with tempfile.SpooledTemporaryFile(
+            RESPONSE_MEMORY_BYTES, "w+", encoding="utf-8"
+        ) as buffer:
+            try:
+                with self.lock:
+                    self.database(path).install()
+                    main.STATS.reset()
+                    main.PAGER.hits = main.PAGER.misses = 0
+                    with redirect_stdout(buffer), redirect_stderr(buffer):
+                        main.dispatch(command)
+            finally:
+                buffer.seek(0)
+                shutil.copyfileobj(buffer, writer)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        stream = open(self.wfile.fileno(), "w", encoding="utf-8", closefd=False)
+        lines = (line.decode("utf-8", errors="replace") for line in self.rfile)
+        try:
+            self.server.query_server.serve_stream(
+                self.server.database_path, lines, stream
+            )
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path, socket_path=None, catalog_cache=None, jobs=1, output_format="pipe"):
+    """Serve queries on the database at path, from stdin or, if socket_path
+    is given, from connections to a Unix socket there. The catalog cache,
+    if given, is used for that database only. Rows are sent back in the
+    given text format."""
+    if output_format not in TEXT_SINKS:
+        raise ValueError(f"Can't serve rows in the {output_format} format")
+    main.JOBS = jobs
+    main.OUTPUT_FORMAT, main.OUTPUT_PATH = output_format, None
+    server = Server()
+    with server.lock:
+        server.database(path, catalog_cache)
+    if socket_path is None:
+        server.serve_stream(path, sys.stdin, sys.stdout)
+        return
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # Left over from an earlier run.
+    with UnixServer(socket_path, RequestHandler) as unix_server:
+        unix_server.query_server = server
+        unix_server.database_path = path
+        try:
+            unix_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+
+# END
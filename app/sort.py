@@ -0,0 +1,109 @@
+import heapq
+import itertools
+import pickle
+import tempfile
+
+from .expressions import sort_key
+from .overflow import materialize
+
+# Rows sorted in memory at a time. Longer inputs are sorted in runs of this
+# many rows, which are spilled to temporary files and merged.
+SORT_RUN_ROWS = 100_000
+
+# Rows pickled together when spilling a run, to keep the per-row overhead
+# of pickling down.
+SPILL_BATCH_ROWS = 1024
+
+
+# -- Sort keys.
+
+
+class Descending:
+    """Wrap a sort key to reverse its order, for ORDER BY ... DESC. Keys of
+    different types can't be negated, so this is how one term of a key is
+    reversed while the others are not."""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def make_order_key(terms):
+    """Return a function from a row to its sort key, for a list of (position
+    in the row, descending) terms. Values are ordered as SQLite does: NULLs,
+    then numbers, text and BLOBs."""
+
+    def order_key(row):
+        return tuple(
+            (
+                Descending(sort_key(materialize(row[i])))
+                if descending
+                else sort_key(materialize(row[i]))
+            )
+            for i, descending in terms
+        )
+
+    return order_key
+
+
+# END
+
+
+# -- Sorting.
+#    Both sorts are stable, so rows that compare equal keep the order they
+#    came in, which is rowid order for rows from a table.
+
+
+def top_k(rows, key, k):
+    """Yield the k smallest rows in order, keeping only k rows in a heap
+    while reading them. Nothing is read until the first row is asked for."""
+    yield from heapq.nsmallest(k, rows, key=key)
+
+
+def external_sort(rows, key, run_rows=SORT_RUN_ROWS):
+    """Yield the rows in order. If there are no more than run_rows of them
+    they are sorted in memory, and otherwise in sorted runs of run_rows
+    that are spilled to temporary files and merged back while yielding."""
+    rows = iter(rows)
+    run = sorted(itertools.islice(rows, run_rows), key=key)
+    if len(run) < run_rows:
+        yield from run
+        return
+    runs = []
+    try:
+        while run:
+            runs.append(spill(run))
+            run = sorted(itertools.islice(rows, run_rows), key=key)
+        yield from heapq.merge(*map(read_run, runs), key=key)
+    finally:
+        for f in runs:
+            f.close()
+
+
+def spill(run):
+    """Write a run of rows to a temporary file, which is deleted when it is
+    closed. Values on overflow pages are pickled as their plain values."""
+    f = tempfile.TemporaryFile()
+    for start in range(0, len(run), SPILL_BATCH_ROWS):
+        pickle.dump(run[start : start + SPILL_BATCH_ROWS], f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def read_run(f):
+    while True:
+        try:
+            batch = pickle.load(f)
+        except EOFError:
+            return
+        yield from batch
+
+
+# END
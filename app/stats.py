@@ -0,0 +1,102 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Names of the B-tree page types, by the flag in the first byte of the page.
+# Refer to '1.6. B-tree Pages' of https://www.sqlite.org/fileformat.html
+PAGE_TYPE_NAMES = {
+    2: "index_interior",
+    5: "table_interior",
+    10: "index_leaf",
+    13: "table_leaf",
+}
+
+
+class Stats:
+    """
+    Counters and timers describing the work done by a query.
+
+    The counters are plain attributes, bumped by the pager, the B-tree
+    walks, the cell reader and the CLI as they go, so that keeping them is
+    cheap enough to always be on. Timers add up the wall clock time spent in
+    named stages.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.reset_counters()
+        self.timers = Counter()
+
+    def reset_counters(self):
+        """Zero the counters, keeping the timers."""
+        # Pages visited by the B-tree walks, by page type, and overflow pages
+        # read for their payload.
+        self.pages = Counter()
+        self.overflow_pages_read = 0
+        # Links of overflow chains followed to find the next page.
+        self.overflow_pages_followed = 0
+        self.cells_decoded = 0
+        self.columns_decoded = 0
+        self.rows_emitted = 0
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[stage] += time.perf_counter() - start
+
+    def merge(self, other, pager=None):
+        """Add the counters of a dict from as_dict(), e.g. from a worker,
+        and its cache counters to those of the pager, if one is given."""
+        for name, n in other["pages"].items():
+            if name != "overflow":
+                self.pages[PAGE_TYPE_CODES[name]] += n
+        for name in ("cells_decoded", "columns_decoded", "rows_emitted"):
+            setattr(self, name, getattr(self, name) + other[name])
+        self.overflow_pages_read += other["pages"].get("overflow", 0)
+        self.overflow_pages_followed += other["overflow_pages_followed"]
+        if pager is not None and "cache" in other:
+            pager.hits += other["cache"]["hits"]
+            pager.misses += other["cache"]["misses"]
+
+    def as_dict(self, pager=None):
+        """Return the counters and timers as a dict of plain values. The
+        cache counters come from the pager, if one is given."""
+        pages = {PAGE_TYPE_NAMES.get(t, str(t)): n for t, n in self.pages.items()}
+        if self.overflow_pages_read:
+            pages["overflow"] = self.overflow_pages_read
+        stats = {
+            "pages": pages,
+            "overflow_pages_followed": self.overflow_pages_followed,
+            "cells_decoded": self.cells_decoded,
+            "columns_decoded": self.columns_decoded,
+            "rows_emitted": self.rows_emitted,
+            "timers": dict(self.timers),
+        }
+        if pager is not None:
+            stats["cache"] = {"hits": pager.hits, "misses": pager.misses}
+        return stats
+
+
+PAGE_TYPE_CODES = {name: code for code, name in PAGE_TYPE_NAMES.items()}
+
+# The counters of this process. They cover everything since the last reset.
+STATS = Stats()
+
+
+def format_stats(stats):
+    """Render the dict from Stats.as_dict() as lines of "name: value"."""
+    lines = []
+    for name, value in stats.items():
+        if isinstance(value, dict):
+            for key, n in sorted(value.items()):
+                if isinstance(n, float):
+                    n = f"{n * 1000:.3f} ms"
+                lines.append(f"{name}.{key}: {n}")
+        else:
+            lines.append(f"{name}: {value}")
+    return lines
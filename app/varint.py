@@ -1,15 +1,16 @@
-def read_varint(data):
-    """Decode a single varint from bytes and return it and the rest of the data."""
+def read_varint(data, offset=0):
+    """Decode a single varint starting at offset in data.
+    Return the value and the offset of the first byte after the varint."""
     result = 0
-    shift = 0
-
-    for i, byte in enumerate(data):
-        if i == 8:
-            break
-        result = (result << shift) | (byte & 0x7F)
-        shift += 7
-        if not byte & 0x80:
-            return result, data[i + 1 :]
-    # Not tested!
-    result = (result << 8) | byte
-    return result, data[8:]
+    for i in range(offset, offset + 8):
+        byte = data[i]
+        result = (result << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return result, i + 1
+    # The ninth byte contributes all eight of its bits.
+    result = (result << 8) | data[offset + 8]
+    # Varints are 64-bit twos-complement integers, and only a nine byte
+    # varint can have the sign bit set.
+    if result >= 1 << 63:
+        result -= 1 << 64
+    return result, offset + 9
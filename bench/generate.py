@@ -0,0 +1,174 @@
+import argparse
+import os
+import random
+import sqlite3
+
+# -- Table shapes.
+#    Each shape is a table named "items" with an INTEGER PRIMARY KEY id, an
+#    indexed low-cardinality column "country" and an unindexed numeric column
+#    "score", so that every shape can run the same set of queries. They differ
+#    in how much else is in a row.
+
+COUNTRIES = [f"country{i:03d}" for i in range(200)]
+
+WIDE_COLUMNS = 40
+
+# Sizes of the body in overflow rows. Most rows fit on a page, some spill
+# onto one or two overflow pages and a few onto many.
+OVERFLOW_BODY_SIZES = [20, 200, 2_000, 20_000, 200_000]
+OVERFLOW_BODY_WEIGHTS = [40, 40, 15, 4, 1]
+
+
+def narrow_row(rng, rowid):
+    return (
+        rowid,
+        f"name{rng.randrange(1_000_000)}",
+        rng.choice(COUNTRIES),
+        rng.randrange(1000),
+    )
+
+
+def wide_row(rng, rowid):
+    row = [rowid, f"name{rng.randrange(1_000_000)}", rng.choice(COUNTRIES)]
+    row.append(rng.randrange(1000))
+    for i in range(WIDE_COLUMNS):
+        kind = i % 4
+        if kind == 0:
+            row.append(rng.randrange(-(2**40), 2**40))
+        elif kind == 1:
+            row.append(rng.random() * 1000)
+        elif kind == 2:
+            row.append(f"text{rng.randrange(10**6)}" * rng.randrange(1, 4))
+        else:
+            row.append(None if rng.random() < 0.3 else rng.randrange(100))
+    return tuple(row)
+
+
+def overflow_row(rng, rowid):
+    (size,) = rng.choices(OVERFLOW_BODY_SIZES, OVERFLOW_BODY_WEIGHTS)
+    body = "".join(rng.choices("abcdefghijklmnopqrstuvwxyzé€ ", k=size))
+    data = rng.randbytes(rng.choice([0, 16, size // 2]))
+    return (
+        rowid,
+        f"name{rng.randrange(1_000_000)}",
+        rng.choice(COUNTRIES),
+        rng.randrange(1000),
+        body,
+        data,
+    )
+
+
+def wide_columns():
+    columns = ["id integer primary key", "name text", "country text", "score int"]
+    types = ["integer", "real", "text", "int"]
+    columns += [f"c{i} {types[i % 4]}" for i in range(WIDE_COLUMNS)]
+    return columns
+
+
+SHAPES = {
+    "narrow": (
+        ["id integer primary key", "name text", "country text", "score int"],
+        narrow_row,
+    ),
+    "wide": (wide_columns(), wide_row),
+    "overflow": (
+        [
+            "id integer primary key",
+            "name text",
+            "country text",
+            "score int",
+            "body text",
+            "data blob",
+        ],
+        overflow_row,
+    ),
+}
+
+PAGE_SIZES = [512, 1024, 2048, 4096, 8192, 16384, 32768, 65536]
+
+# Rows are inserted this many at a time.
+BATCH_SIZE = 10_000
+
+# END
+
+
+# -- Generating databases.
+
+
+def database_name(shape, rows, page_size, seed=0):
+    return f"{shape}-{rows}-{page_size}-{seed}.db"
+
+
+def generate(path, shape, rows, page_size, seed=0):
+    """Write a database of the given shape to path, replacing any file there.
+    The contents only depend on the arguments, so the same database can be
+    generated again on another machine or commit."""
+    if page_size not in PAGE_SIZES:
+        raise ValueError(f"Page size must be one of {PAGE_SIZES}, got {page_size}")
+    columns, make_row = SHAPES[shape]
+    # Build under a temporary name, so that an interrupted run does not
+    # leave a partial database to be reused.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute(f"PRAGMA page_size = {page_size}")
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute(f"CREATE TABLE items ({', '.join(columns)})")
+        connection.execute("CREATE TABLE notes (id integer primary key, note text)")
+        connection.execute("INSERT INTO notes VALUES (1, 'generated')")
+        insert = f"INSERT INTO items VALUES ({', '.join('?' * len(columns))})"
+        rng = random.Random(seed)
+        for start in range(1, rows + 1, BATCH_SIZE):
+            end = min(start + BATCH_SIZE, rows + 1)
+            connection.executemany(
+                insert, (make_row(rng, rowid) for rowid in range(start, end))
+            )
+        # Indexing after the inserts is much faster than maintaining the
+        # index on the way.
+        connection.execute("CREATE INDEX idx_items_country ON items (country)")
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+
+
+def ensure_database(directory, shape, rows, page_size, seed=0):
+    """Return the path of the database with these parameters in directory,
+    generating it first if it isn't there."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, database_name(shape, rows, page_size, seed))
+    if not os.path.exists(path):
+        generate(path, shape, rows, page_size, seed)
+    return path
+
+
+def parse_count(text):
+    """Parse a row count, allowing forms like 1e6 and 100_000."""
+    try:
+        return int(text)
+    except ValueError:
+        count = float(text)
+        if not count.is_integer():
+            raise argparse.ArgumentTypeError(f"Not a whole number: {text}")
+        return int(count)
+
+
+# END
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog="bench.generate", description="Generate a benchmark database."
+    )
+    parser.add_argument("path")
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="narrow")
+    parser.add_argument("--rows", type=parse_count, default=1000)
+    parser.add_argument("--page-size", type=int, default=4096)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.path, args.shape, args.rows, args.page_size, args.seed)
@@ -0,0 +1,351 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+
+from .generate import PAGE_SIZES, SHAPES, ensure_database, parse_count
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# -- Queries.
+#    Every shape has the columns these use, see generate.py. {middle} is
+#    replaced by a rowid in the middle of the table.
+
+QUERIES = {
+    "dbinfo": ".dbinfo",
+    "tables": ".tables",
+    "count": "SELECT COUNT(*) FROM items",
+    "full_scan": "SELECT id, name, score FROM items",
+    "filtered_scan": "SELECT id, name FROM items WHERE score < 10",
+    "indexed_lookup": "SELECT id, name FROM items WHERE country = 'country042'",
+    "rowid_lookup": "SELECT id, name, country FROM items WHERE id = {middle}",
+}
+
+# Queries that only make sense for some shapes.
+SHAPE_QUERIES = {
+    "wide": {"wide_scan": "SELECT c0, c9, c22, c39 FROM items"},
+    "overflow": {"overflow_scan": "SELECT id, body, data FROM items"},
+}
+
+# END
+
+
+# -- Checking results against sqlite3.
+
+
+def format_row(row):
+    """Format a row as app.main prints it."""
+    return "|".join("NULL" if value is None else str(value) for value in row)
+
+
+class OutputDigest:
+    """
+    Digests of the lines of an output, one that depends on their order and
+    one that does not. Rows without ORDER BY may come out in a different
+    order from sqlite3, when it happens to use an index, and still be right.
+    """
+
+    def __init__(self):
+        self.ordered = hashlib.sha256()
+        self.unordered = 0
+        self.lines = 0
+
+    def add(self, line):
+        self.ordered.update(line)
+        self.ordered.update(b"\n")
+        digest = hashlib.sha256(line).digest()
+        self.unordered = (self.unordered + int.from_bytes(digest)) % 2**256
+        self.lines += 1
+
+
+def expected_digest(connection, sql):
+    digest = OutputDigest()
+    for row in connection.execute(sql):
+        digest.add(format_row(row).encode())
+    return digest
+
+
+def check_dot_command(connection, command, output):
+    """Check the output of .dbinfo or .tables, returning "ok" or "mismatch"."""
+    table_names = [
+        name
+        for (name,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    ]
+    lines = output.decode().splitlines()
+    if command == ".dbinfo":
+        (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+        expected = [
+            f"database page size: {page_size}",
+            f"number of tables: {len(table_names)}",
+        ]
+        ok = all(line in lines for line in expected)
+    else:
+        names = [n for n in table_names if n != "sqlite_sequence"]
+        ok = sorted(output.decode().split()) == sorted(names)
+    return "ok" if ok else "mismatch"
+
+
+def check_select(command, sql, connection):
+    """Run the query once more, streaming its output into a digest, and
+    compare it with sqlite3's. Return (check, number of rows)."""
+    digest = OutputDigest()
+    process = subprocess.Popen(
+        command, cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    for line in process.stdout:
+        digest.add(line.rstrip(b"\n"))
+    if process.wait() != 0:
+        return "error", digest.lines
+    expected = expected_digest(connection, sql)
+    if digest.ordered.digest() == expected.ordered.digest():
+        return "ok", digest.lines
+    if digest.unordered == expected.unordered and digest.lines == expected.lines:
+        return "ok-unordered", digest.lines
+    return "mismatch", digest.lines
+
+
+# END
+
+
+# -- Timing.
+
+
+def time_command(command):
+    """Run command with its output discarded. Return (wall clock seconds,
+    CPU seconds, exit status)."""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    status = subprocess.call(
+        command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return wall, cpu, status
+
+
+def time_sqlite3(connection, sql):
+    """Time sqlite3 itself on the query, for scale."""
+    start = time.perf_counter()
+    for _ in connection.execute(sql):
+        pass
+    return time.perf_counter() - start
+
+
+def run_query(path, sql, repeat, jobs, check):
+    """Time app.main on one query. The fastest of the runs is the one
+    reported, being the least disturbed by the rest of the machine."""
+    command = [sys.executable, "-m", "app.main", path, sql]
+    if jobs != 1:
+        command += ["--jobs", str(jobs)]
+    result = {"seconds": None, "all_seconds": [], "cpu_seconds": None}
+    for _ in range(repeat):
+        wall, cpu, status = time_command(command)
+        if status != 0:
+            result["check"] = "error"
+            return result
+        result["all_seconds"].append(wall)
+        if result["seconds"] is None or wall < result["seconds"]:
+            result["seconds"], result["cpu_seconds"] = wall, cpu
+    if not check:
+        return result
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        if sql.startswith("."):
+            output = subprocess.run(
+                command, cwd=REPO_ROOT, stdout=subprocess.PIPE
+            ).stdout
+            result["check"] = check_dot_command(connection, sql, output)
+        else:
+            result["check"], result["rows_out"] = check_select(command, sql, connection)
+            result["sqlite3_seconds"] = time_sqlite3(connection, sql)
+    finally:
+        connection.close()
+    return result
+
+
+# END
+
+
+# -- Comparing runs.
+
+
+def result_key(result):
+    return (result["database"], result["query"])
+
+
+def compare(baseline, current, threshold):
+    """Print the change in time of each query found in both runs, and
+    return the number that got slower by more than the threshold."""
+    baseline_results = {result_key(r): r for r in baseline["results"]}
+    regressions = 0
+    print(f"baseline {baseline.get('commit')}, current {current.get('commit')}")
+    for result in current["results"]:
+        before = baseline_results.get(result_key(result))
+        if not before or not before["seconds"] or not result["seconds"]:
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(
+            f"{result['database']:32} {result['query']:16}"
+            f" {before['seconds']:9.4f}s -> {result['seconds']:9.4f}s"
+            f" ({ratio:5.2f}x){flag}"
+        )
+    return regressions
+
+
+# END
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    queries = dict(QUERIES)
+    for extra in SHAPE_QUERIES.values():
+        queries.update(extra)
+    selected = args.queries or list(queries)
+    unknown = set(selected) - set(queries)
+    if unknown:
+        raise ValueError(f"Unknown queries: {', '.join(sorted(unknown))}")
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "repeat": args.repeat,
+        "jobs": args.jobs,
+        "results": [],
+    }
+    for shape in args.shapes:
+        shape_queries = dict(QUERIES, **SHAPE_QUERIES.get(shape, {}))
+        for rows in args.rows:
+            for page_size in args.page_sizes:
+                path = ensure_database(args.data_dir, shape, rows, page_size)
+                database = os.path.basename(path)
+                for name in selected:
+                    if name not in shape_queries:
+                        continue
+                    sql = shape_queries[name].format(middle=max(rows // 2, 1))
+                    result = {
+                        "database": database,
+                        "shape": shape,
+                        "rows": rows,
+                        "page_size": page_size,
+                        "size_bytes": os.path.getsize(path),
+                        "query": name,
+                        "sql": sql,
+                    }
+                    result.update(
+                        run_query(
+                            os.path.abspath(path),
+                            sql,
+                            args.repeat,
+                            args.jobs,
+                            not args.no_check,
+                        )
+                    )
+                    report["results"].append(result)
+                    seconds = result["seconds"]
+                    print(
+                        f"{database:32} {name:16}"
+                        f" {'-' if seconds is None else f'{seconds:9.4f}s'}"
+                        f" {result.get('check', '')}",
+                        flush=True,
+                    )
+    return report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog="bench.run",
+        description="Time app.main on generated databases, checking the "
+        "results against sqlite3.",
+    )
+    parser.add_argument(
+        "--rows",
+        type=parse_count,
+        nargs="+",
+        default=[1000, 10_000, 100_000],
+        metavar="N",
+        help="table sizes, e.g. 1e3 1e7 (default: 1e3 1e4 1e5)",
+    )
+    parser.add_argument(
+        "--shapes", nargs="+", choices=sorted(SHAPES), default=sorted(SHAPES)
+    )
+    parser.add_argument(
+        "--page-sizes",
+        type=int,
+        nargs="+",
+        choices=PAGE_SIZES,
+        default=[4096],
+        metavar="SIZE",
+        help="page sizes from 512 to 65536 (default: 4096)",
+    )
+    parser.add_argument(
+        "--queries", nargs="+", metavar="NAME", help="run only these queries"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=1, help="passed on to app.main"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(REPO_ROOT, "bench_data"),
+        help="where generated databases are kept between runs",
+    )
+    parser.add_argument(
+        "--output", default=os.path.join(REPO_ROOT, "bench_output.json")
+    )
+    parser.add_argument(
+        "--no-check", action="store_true", help="don't compare with sqlite3"
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="compare with the results of an earlier run, written by --output",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.1,
+        help="with --compare, the ratio of times counted as a regression",
+    )
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    failed = [r for r in report["results"] if r.get("check") in ("error", "mismatch")]
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+    if failed or regressions:
+        sys.exit(1)
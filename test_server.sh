@@ -0,0 +1,81 @@
+#!/bin/sh
+#
+# Run a scripted session against the server mode (--serve, over stdin) and
+# compare the responses with the expected ones. It covers .open, an error,
+# dot-stuffing of output lines that start with "." and the database file
+# being replaced between requests.
+
+set -e
+
+dir=$(mktemp -d)
+trap 'rm -rf "$dir"' EXIT
+
+# make_db PATH TABLE VALUE... creates a database with one TEXT column.
+make_db() {
+    python3 - "$@" <<'EOF'
+import sqlite3
+import sys
+
+path, table, *values = sys.argv[1:]
+connection = sqlite3.connect(path)
+connection.execute(f"CREATE TABLE {table} (v text)")
+connection.executemany(f"INSERT INTO {table} VALUES (?)", [(v,) for v in values])
+connection.commit()
+EOF
+}
+
+make_db "$dir/a.db" x a1 .a2
+make_db "$dir/b.db" y b1
+make_db "$dir/c.db" z c1
+
+mkfifo "$dir/in"
+./your_program.sh "$dir/a.db" --serve <"$dir/in" >"$dir/out" 2>&1 &
+server=$!
+exec 3>"$dir/in"
+
+# send COMMAND sends a command and waits for its response to end, with a
+# line holding "." or ".error: message".
+responses=0
+send() {
+    printf '%s\n' "$1" >&3
+    responses=$((responses + 1))
+    while [ "$(grep -c -E '^\.($|error: )' "$dir/out")" -lt "$responses" ]; do
+        if ! kill -0 "$server" 2>/dev/null; then
+            cat "$dir/out"
+            echo "server exited" >&2
+            exit 1
+        fi
+        sleep 0.05
+    done
+}
+
+send ".tables"
+send "SELECT v FROM x"
+send "SELECT nope FROM x"
+# Replace the file with another database, which has the same schema cookie.
+mv "$dir/b.db" "$dir/a.db"
+send ".tables"
+send "SELECT v FROM y"
+send "SELECT v FROM x"
+send ".open $dir/c.db"
+send "SELECT v FROM z"
+exec 3>&-
+wait "$server"
+
+diff -u - "$dir/out" <<'EOF'
+x
+.
+a1
+..a2
+.
+.error: No such column: nope
+y
+.
+b1
+.
+.error: No such table: x
+.
+c1
+.
+EOF
+echo "server session: ok"